@@ -2,26 +2,31 @@
 Streamlit Web UI for AWS Bedrock Code Review Agent
 """
 import streamlit as st
-import os
-import json
+import orjson
+import asyncio
+import hashlib
+import time
 import tempfile
 from pathlib import Path
 from review_agent import (
     analyze_code,
+    analyze_bytes,
     analyze_file,
     analyze_diff,
+    DIFF_SUFFIXES,
     save_results,
     apply_fix_to_file,
-    extract_suggestion_code
+    apply_all_fixes,
+    load_aws_settings,
+    aggregate_file_results,
+    analyze_code_batch_async,
+    batch_enabled,
+    submit_batch_review,
+    get_batch_review
 )
-from dotenv import load_dotenv
-from pathlib import Path
 
-# Load .env file from the project root
+# review_agent loads this .env on import; the path is kept for the debug panel
 env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path, override=True)
-# Also try loading from current directory
-load_dotenv(override=False)
 
 # Page configuration
 st.set_page_config(
@@ -33,8 +38,225 @@ st.set_page_config(
 # Initialize session state
 if 'review_results' not in st.session_state:
     st.session_state.review_results = None
+    st.session_state.results_hash = None
+    st.session_state.expanded_issue = None
 if 'current_file' not in st.session_state:
     st.session_state.current_file = None
+    st.session_state.pending_upload = None
+if 'batch_job' not in st.session_state:
+    st.session_state.batch_job = None
+
+
+SEVERITY_ICONS = {"HIGH": "🔴", "MEDIUM": "🟡"}
+DEFAULT_SEVERITY_ICON = "🔵"
+
+# (minimum score, icon, label), highest band first
+SCORE_BANDS = [(8, "🟢", "Excellent"), (5, "🟡", "Good")]
+DEFAULT_SCORE_BAND = ("🔴", "Needs Improvement")
+
+
+def _score_band(score) -> tuple:
+    """Return the (icon, label) for an overall score."""
+    for minimum, icon, label in SCORE_BANDS:
+        if score >= minimum:
+            return icon, label
+    return DEFAULT_SCORE_BAND
+
+
+def _fix_target() -> str:
+    """
+    Return the path fixes should be applied to.
+    
+    Uploads are reviewed straight from memory; they are only written to a
+    temporary file the first time a fix is applied.
+    """
+    upload = st.session_state.pending_upload
+    if upload is not None:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{upload['name']}") as tmp_file:
+            tmp_file.write(upload['content'])
+        st.session_state.current_file = tmp_file.name
+        st.session_state.pending_upload = None
+    return st.session_state.current_file
+
+
+def _stream_to(placeholder, interval: float = 0.05):
+    """Build an on_text callback that shows the response as it streams in."""
+    parts = []
+    last_update = [0.0]
+    
+    def on_text(text: str):
+        parts.append(text)
+        now = time.monotonic()
+        if now - last_update[0] >= interval:
+            placeholder.code(''.join(parts), language='json')
+            last_update[0] = now
+    
+    return on_text
+
+
+def _toggle_issue(idx: int):
+    """Expand the issue at idx, or collapse it if it is already expanded."""
+    st.session_state.expanded_issue = None if st.session_state.expanded_issue == idx else idx
+
+
+def _upload_contents(uploaded_files) -> dict:
+    """
+    Decode uploads into a name -> text mapping for multi-file reviews.
+    
+    Undecodable bytes are replaced rather than aborting the run, and uploads
+    sharing a name get a " (2)", " (3)", ... suffix instead of overwriting
+    each other.
+    """
+    contents = {}
+    for f in uploaded_files:
+        name = f.name
+        copy_number = 2
+        while name in contents:
+            name = f"{f.name} ({copy_number})"
+            copy_number += 1
+        contents[name] = f.getvalue().decode('utf-8', errors='replace')
+    
+    if len(contents) > len({f.name for f in uploaded_files}):
+        st.warning("Some uploads share a file name; duplicates are reviewed as \"name (2)\" and so on.")
+    return contents
+
+
+def _store_results(results: dict):
+    """Keep results in the session, tagged with a content hash, and save them."""
+    st.session_state.review_results = results
+    st.session_state.expanded_issue = None
+    st.session_state.results_hash = hashlib.blake2b(
+        orjson.dumps(results, option=orjson.OPT_SORT_KEYS),
+        digest_size=16
+    ).hexdigest()
+    save_results(results)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _serialize_results(results_hash: str, _results: dict) -> bytes:
+    """Serialize results for download once per distinct result set."""
+    return orjson.dumps(_results, option=orjson.OPT_INDENT_2)
+
+
+def render_results(results: dict):
+    """Render a review result in the results tab."""
+    
+    # Display error if any
+    if "error" in results:
+        st.error(f"❌ Error: {results['error']}")
+        return
+    
+    # Summary section
+    st.subheader("📋 Summary")
+    summary = results.get('summary', 'No summary available')
+    st.info(summary)
+    
+    # Overall score
+    score = results.get('overall_score', 0)
+    score_icon, score_label = _score_band(score)
+    st.metric("Overall Score", f"{score}/10", delta=None)
+    st.markdown(f"{score_icon} {score_label}")
+    
+    st.markdown("---")
+    
+    # Issues section
+    issues = results.get('issues', [])
+    if issues:
+        st.subheader(f"⚠️ Issues Found ({len(issues)})")
+        
+        has_target = (
+            st.session_state.pending_upload is not None or
+            (st.session_state.current_file and st.session_state.current_file != "pasted_code")
+        )
+        fixable = [issue for issue in issues if issue.get('suggestion')]
+        if has_target and len(fixable) > 1:
+            if st.button(f"✅ Apply All Fixes ({len(fixable)})", key="apply_all"):
+                with st.spinner("Applying fixes..."):
+                    outcomes = apply_all_fixes(fixable, _fix_target())
+                applied = sum(1 for success, _ in outcomes if success)
+                if applied:
+                    st.success(f"Applied {applied} of {len(fixable)} fixes")
+                    st.info("🔄 Please re-analyze the file to see updated results")
+                for success, msg in outcomes:
+                    if not success:
+                        st.error(msg)
+        
+        for idx, issue in enumerate(issues):
+            severity = issue.get('severity', 'low').upper()
+            issue_type = issue.get('type', 'unknown')
+            line_num = issue.get('line', 'N/A')
+            message = issue.get('message', 'No message')
+            suggestion = issue.get('suggestion', '')
+            
+            # Severity color coding
+            severity_icon = SEVERITY_ICONS.get(severity, DEFAULT_SEVERITY_ICON)
+            
+            # Only the selected issue's body is built on each rerun
+            is_expanded = st.session_state.expanded_issue == idx
+            st.button(
+                f"{'▼' if is_expanded else '▶'} {severity_icon} [{severity}] {issue_type} - Line {line_num}",
+                key=f"exp_{idx}",
+                on_click=_toggle_issue,
+                args=(idx,),
+                use_container_width=True
+            )
+            if not is_expanded:
+                continue
+            
+            st.markdown(f"**Message:** {message}")
+            
+            if suggestion:
+                st.markdown("**Suggestion:**")
+                st.code(suggestion, language='python')
+                
+                # Apply fix button
+                if has_target:
+                    if st.button(f"✅ Apply Fix #{idx + 1}", key=f"apply_{idx}"):
+                        with st.spinner("Applying fix..."):
+                            success, msg = apply_fix_to_file(
+                                _fix_target(),
+                                issue
+                            )
+                            if success:
+                                st.success(msg)
+                                st.info("🔄 Please re-analyze the file to see updated results")
+                            else:
+                                st.error(msg)
+    else:
+        st.success("✅ No issues found!")
+    
+    st.markdown("---")
+    
+    # Missing docstrings section
+    missing_docs = results.get('missing_docstrings', [])
+    if missing_docs:
+        st.subheader(f"📝 Missing Docstrings ({len(missing_docs)})")
+        
+        for doc in missing_docs:
+            func_name = doc.get('function', 'unknown')
+            line_num = doc.get('line', 'N/A')
+            doc_suggestion = doc.get('suggestion', '')
+            
+            with st.expander(f"Function: `{func_name}` (Line {line_num})"):
+                if doc_suggestion:
+                    st.code(doc_suggestion, language='python')
+                else:
+                    st.info("No docstring suggestion available")
+    
+    # Raw JSON view
+    st.markdown("---")
+    # Expander bodies are built even when collapsed, so use a toggle
+    if st.checkbox("📄 View Raw JSON"):
+        st.json(results)
+    
+    # Download results
+    st.markdown("---")
+    st.download_button(
+        label="📥 Download Results as JSON",
+        data=_serialize_results(st.session_state.results_hash, results),
+        file_name=f"review_results_{results.get('file_path', 'unknown').replace('/', '_')}.json",
+        mime="application/json"
+    )
 
 
 def main():
@@ -45,21 +267,16 @@ def main():
     with st.sidebar:
         st.header("⚙️ Configuration")
         
-        def sanitize_credential(value):
-            """Remove quotes and whitespace from credentials."""
-            if not value:
-                return None
-            return value.strip().strip('"').strip("'").strip()
-        
         # Check AWS credentials
-        aws_region = sanitize_credential(os.getenv("AWS_REGION")) or sanitize_credential(os.getenv("AWS_DEFAULT_REGION")) or "us-east-1"
-        aws_key = sanitize_credential(os.getenv("AWS_ACCESS_KEY_ID")) or sanitize_credential(os.getenv("AWS_ACCESS_KEY"))
-        aws_secret = sanitize_credential(os.getenv("AWS_SECRET_ACCESS_KEY")) or sanitize_credential(os.getenv("AWS_SECRET_KEY"))
-        aws_session_token = sanitize_credential(os.getenv("AWS_SESSION_TOKEN")) or sanitize_credential(os.getenv("AWS_SECURITY_TOKEN"))
-        model_id = os.getenv("MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+        settings = load_aws_settings()
+        aws_region = settings.region
+        aws_key = settings.access_key
+        aws_secret = settings.secret_key
+        aws_session_token = settings.session_token
+        model_id = settings.model_id
         
         # Check if using temporary credentials
-        is_temporary = aws_key and aws_key.startswith("ASIA")
+        is_temporary = settings.is_temporary
         
         # Check if .env file exists
         env_file_exists = env_path.exists()
@@ -134,10 +351,11 @@ AWS_SESSION_TOKEN=...
     with tab1:
         st.header("Upload Code File or Diff")
         
-        uploaded_file = st.file_uploader(
-            "Choose a file",
+        uploaded_files = st.file_uploader(
+            "Choose files",
             type=['py', 'js', 'ts', 'java', 'cpp', 'c', 'go', 'rs', 'diff', 'patch'],
-            help="Upload a code file or diff file for review"
+            accept_multiple_files=True,
+            help="Upload one or more code files or diff files for review"
         )
         
         col1, col2 = st.columns(2)
@@ -151,36 +369,73 @@ AWS_SESSION_TOKEN=...
         
         with col2:
             if st.button("🔍 Analyze File", type="primary", use_container_width=True):
-                if uploaded_file:
-                    # Save uploaded file temporarily
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.name}") as tmp_file:
-                        tmp_file.write(uploaded_file.getbuffer())
-                        temp_path = tmp_file.name
-                    
-                    st.session_state.current_file = temp_path
+                if len(uploaded_files) == 1:
+                    uploaded_file = uploaded_files[0]
+                    st.session_state.current_file = None
+                    st.session_state.pending_upload = {
+                        "name": uploaded_file.name,
+                        "content": uploaded_file.getvalue()
+                    }
                     with st.spinner("Analyzing code with AWS Bedrock..."):
-                        if uploaded_file.name.endswith(('.diff', '.patch')):
-                            results = analyze_diff(temp_path)
-                        else:
-                            results = analyze_file(temp_path)
-                        st.session_state.review_results = results
-                        save_results(results)
+                        stream_placeholder = st.empty()
+                        # analyze_bytes serves repeat uploads from the review cache
+                        results = analyze_bytes(
+                            uploaded_file.getvalue(),
+                            uploaded_file.name,
+                            _stream_to(stream_placeholder)
+                        )
+                        stream_placeholder.empty()
+                        _store_results(results)
                     st.success("✅ Analysis complete!")
-                    st.rerun()
+                
+                elif uploaded_files:
+                    # Uploaded files only exist in memory, so fixes can't be applied
+                    st.session_state.current_file = None
+                    st.session_state.pending_upload = None
+                    contents = _upload_contents(uploaded_files)
+                    if batch_enabled(len(contents)):
+                        with st.spinner("Submitting batch job to AWS Bedrock..."):
+                            job = submit_batch_review(contents)
+                        if "error" in job:
+                            st.error(f"❌ Error: {job['error']}")
+                        else:
+                            st.session_state.batch_job = job
+                    else:
+                        with st.spinner(f"Analyzing {len(contents)} files with AWS Bedrock..."):
+                            results_by_file = asyncio.run(analyze_code_batch_async(list(contents.items())))
+                        results = aggregate_file_results(results_by_file)
+                        _store_results(results)
+                        st.success("✅ Analysis complete!")
                     
                 elif file_path_input:
                     st.session_state.current_file = file_path_input
+                    st.session_state.pending_upload = None
                     with st.spinner("Analyzing code with AWS Bedrock..."):
-                        if file_path_input.endswith(('.diff', '.patch')):
+                        if file_path_input.endswith(DIFF_SUFFIXES):
                             results = analyze_diff(file_path_input)
                         else:
                             results = analyze_file(file_path_input)
-                        st.session_state.review_results = results
-                        save_results(results)
+                        _store_results(results)
                     st.success("✅ Analysis complete!")
-                    st.rerun()
                 else:
                     st.error("Please upload a file or enter a file path")
+        
+        # Pending batch job survives reruns, so the user can come back to it
+        if st.session_state.batch_job:
+            job = st.session_state.batch_job
+            st.info(f"⏳ Batch job submitted: `{job['job_arn']}`")
+            if st.button("🔄 Check Batch Status"):
+                with st.spinner("Checking batch job..."):
+                    batch = get_batch_review(job)
+                if "error" in batch:
+                    st.session_state.batch_job = None
+                    st.error(f"❌ Error: {batch['error']}")
+                elif "results" in batch:
+                    st.session_state.batch_job = None
+                    _store_results(batch['results'])
+                    st.success("✅ Batch analysis complete!")
+                else:
+                    st.write(f"**Status:** {batch['status']}")
     
     with tab2:
         st.header("Paste Code Directly")
@@ -201,12 +456,18 @@ AWS_SESSION_TOKEN=...
         if st.button("🔍 Analyze Code", type="primary", use_container_width=True):
             if code_input:
                 st.session_state.current_file = file_path_for_code or "pasted_code"
+                st.session_state.pending_upload = None
                 with st.spinner("Analyzing code with AWS Bedrock..."):
-                    results = analyze_code(code_input, file_path_for_code)
-                    st.session_state.review_results = results
-                    save_results(results)
+                    stream_placeholder = st.empty()
+                    # Repeat reviews of the same code come from the review cache
+                    results = analyze_code(
+                        code_input,
+                        file_path_for_code,
+                        _stream_to(stream_placeholder)
+                    )
+                    stream_placeholder.empty()
+                    _store_results(results)
                 st.success("✅ Analysis complete!")
-                st.rerun()
             else:
                 st.error("Please enter some code to analyze")
     
@@ -216,105 +477,7 @@ AWS_SESSION_TOKEN=...
         if st.session_state.review_results is None:
             st.info("👆 Upload a file or paste code in the tabs above to get started")
         else:
-            results = st.session_state.review_results
-            
-            # Display error if any
-            if "error" in results:
-                st.error(f"❌ Error: {results['error']}")
-                return
-            
-            # Summary section
-            st.subheader("📋 Summary")
-            summary = results.get('summary', 'No summary available')
-            st.info(summary)
-            
-            # Overall score
-            score = results.get('overall_score', 0)
-            score_color = "🟢" if score >= 8 else "🟡" if score >= 5 else "🔴"
-            st.metric("Overall Score", f"{score}/10", delta=None)
-            st.markdown(f"{score_color} {'Excellent' if score >= 8 else 'Good' if score >= 5 else 'Needs Improvement'}")
-            
-            st.markdown("---")
-            
-            # Issues section
-            issues = results.get('issues', [])
-            if issues:
-                st.subheader(f"⚠️ Issues Found ({len(issues)})")
-                
-                for idx, issue in enumerate(issues):
-                    severity = issue.get('severity', 'low').upper()
-                    issue_type = issue.get('type', 'unknown')
-                    line_num = issue.get('line', 'N/A')
-                    message = issue.get('message', 'No message')
-                    suggestion = issue.get('suggestion', '')
-                    
-                    # Severity color coding
-                    if severity == 'HIGH':
-                        severity_icon = "🔴"
-                        severity_color = "red"
-                    elif severity == 'MEDIUM':
-                        severity_icon = "🟡"
-                        severity_color = "orange"
-                    else:
-                        severity_icon = "🔵"
-                        severity_color = "blue"
-                    
-                    with st.expander(f"{severity_icon} [{severity}] {issue_type} - Line {line_num}"):
-                        st.markdown(f"**Message:** {message}")
-                        
-                        if suggestion:
-                            st.markdown("**Suggestion:**")
-                            st.code(suggestion, language='python')
-                            
-                            # Apply fix button
-                            if st.session_state.current_file and st.session_state.current_file != "pasted_code":
-                                if st.button(f"✅ Apply Fix #{idx + 1}", key=f"apply_{idx}"):
-                                    with st.spinner("Applying fix..."):
-                                        success, msg = apply_fix_to_file(
-                                            st.session_state.current_file,
-                                            issue
-                                        )
-                                        if success:
-                                            st.success(msg)
-                                            st.info("🔄 Please re-analyze the file to see updated results")
-                                        else:
-                                            st.error(msg)
-            else:
-                st.success("✅ No issues found!")
-            
-            st.markdown("---")
-            
-            # Missing docstrings section
-            missing_docs = results.get('missing_docstrings', [])
-            if missing_docs:
-                st.subheader(f"📝 Missing Docstrings ({len(missing_docs)})")
-                
-                for doc in missing_docs:
-                    func_name = doc.get('function', 'unknown')
-                    line_num = doc.get('line', 'N/A')
-                    doc_suggestion = doc.get('suggestion', '')
-                    
-                    with st.expander(f"Function: `{func_name}` (Line {line_num})"):
-                        if doc_suggestion:
-                            st.code(doc_suggestion, language='python')
-                        else:
-                            st.info("No docstring suggestion available")
-            
-            # Raw JSON view
-            st.markdown("---")
-            with st.expander("📄 View Raw JSON"):
-                st.json(results)
-            
-            # Download results
-            st.markdown("---")
-            json_str = json.dumps(results, indent=2)
-            st.download_button(
-                label="📥 Download Results as JSON",
-                data=json_str,
-                file_name=f"review_results_{results.get('file_path', 'unknown').replace('/', '_')}.json",
-                mime="application/json"
-            )
-
+            render_results(st.session_state.review_results)
 
 if __name__ == "__main__":
     main()
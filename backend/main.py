@@ -1,35 +1,59 @@
 """
 FastAPI Backend for AWS Bedrock Code Review Agent
 """
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from anyio import to_thread
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Tuple
+from functools import lru_cache
+import msgspec
+import orjson
 import sys
 import os
+import tempfile
 from pathlib import Path
 
 # Add parent directory to path to import review_agent
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from review_agent import (
-    analyze_code,
+    analyze_code_async,
+    analyze_bytes,
     analyze_file,
     analyze_diff,
+    DIFF_SUFFIXES,
+    is_diff_path,
     save_results,
     apply_fix_to_file,
     extract_suggestion_code,
     analyze_git_repo,
     analyze_directory,
-    analyze_multiple_files,
+    analyze_multiple_files_async,
+    get_batch_review,
     get_code_files
 )
 
+# Bedrock calls and file I/O are blocking, so endpoints run them in worker
+# threads; this caps how many run at once (anyio's default is 40)
+API_WORKER_THREADS = int(os.getenv("API_WORKER_THREADS", "32"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Size the thread limiter used by to_thread.run_sync"""
+    to_thread.current_default_thread_limiter().total_tokens = API_WORKER_THREADS
+    yield
+
+
 app = FastAPI(
     title="AWS Bedrock Code Review Agent API",
     description="REST API for code review using AWS Bedrock",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS middleware - allow frontend to connect
@@ -43,36 +67,72 @@ app.add_middleware(
 
 
 # Request/Response models
-class CodeReviewRequest(BaseModel):
+# Request bodies are msgspec Structs decoded straight from the raw body, which
+# skips Pydantic validation. Review endpoints return LLM-produced dicts as
+# ORJSONResponse objects with response_model=None, so FastAPI neither
+# validates nor re-encodes them.
+class CodeReviewRequest(msgspec.Struct):
     code: str
     file_path: Optional[str] = None
 
 
-class ApplyFixRequest(BaseModel):
+class ApplyFixRequest(msgspec.Struct):
     file_path: str
     issue: dict
 
 
-class GitReviewRequest(BaseModel):
+class GitReviewRequest(msgspec.Struct):
     repo_path: str
     base_ref: Optional[str] = None
     head_ref: Optional[str] = None
 
 
-class DirectoryReviewRequest(BaseModel):
+class DirectoryReviewRequest(msgspec.Struct):
     directory: str
     max_files: int = 50
 
 
-class MultipleFilesRequest(BaseModel):
+class MultipleFilesRequest(msgspec.Struct):
     file_paths: List[str]
 
 
+class BatchStatusRequest(msgspec.Struct):
+    batch_job: dict
+
+
+def json_body(model):
+    """Build a dependency that decodes the JSON request body into a msgspec Struct."""
+    decoder = msgspec.json.Decoder(model)
+    
+    async def decode(request: Request):
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    
+    return decode
+
+
 class HealthResponse(BaseModel):
     status: str
     message: str
 
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+IN_MEMORY_UPLOAD_LIMIT = 1024 * 1024
+
+
+async def _spool_upload(file: UploadFile) -> str:
+    """Copy an upload to a named temp file in chunks and return its path."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as temp_file:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            temp_file.write(chunk)
+    return temp_file.name
+
+
 @app.get("/", response_model=HealthResponse)
 async def root():
     """Health check endpoint"""
@@ -85,231 +145,267 @@ async def health():
     return {"status": "ok", "message": "API is healthy"}
 
 
-@app.post("/api/review/code")
-async def review_code(request: CodeReviewRequest):
+@app.post("/api/review/code", response_model=None)
+async def review_code(request: CodeReviewRequest = Depends(json_body(CodeReviewRequest))):
     """
     Review code from text input
     """
     try:
-        results = analyze_code(request.code, request.file_path)
+        results = await analyze_code_async(request.code, request.file_path)
         
         # Save results
         if "error" not in results:
             save_results(results)
         
-        return JSONResponse(content=results)
+        return ORJSONResponse(content=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/review/file")
+@app.post("/api/review/file", response_model=None)
 async def review_file(file: UploadFile = File(...), file_path: Optional[str] = Form(None)):
     """
     Review code from uploaded file
     """
     try:
-        # Read file content
-        content = await file.read()
-        code_content = content.decode('utf-8')
-        
         # Use provided file_path or filename
-        target_path = file_path or file.filename
-        
-        # Determine if it's a diff file
-        is_diff = (
-            file.filename and (
-                file.filename.endswith('.diff') or 
-                file.filename.endswith('.patch') or 
-                'diff' in file.filename.lower()
-            )
-        )
+        target_path = file_path or file.filename or "uploaded_file"
         
-        if is_diff:
-            results = analyze_diff(target_path) if target_path else analyze_code(code_content, target_path)
+        if file.size is not None and file.size <= IN_MEMORY_UPLOAD_LIMIT:
+            results = await to_thread.run_sync(analyze_bytes, await file.read(), target_path)
         else:
-            results = analyze_code(code_content, target_path)
+            # Large uploads are copied to disk in chunks rather than buffered,
+            # and decoded leniently like the in-memory path
+            temp_path = await _spool_upload(file)
+            try:
+                if target_path.endswith(DIFF_SUFFIXES):
+                    results = await to_thread.run_sync(analyze_diff, temp_path, 'replace')
+                else:
+                    results = await to_thread.run_sync(analyze_file, temp_path, 'replace')
+                results['file_path'] = target_path
+            finally:
+                os.unlink(temp_path)
         
         # Save results
         if "error" not in results:
             save_results(results)
         
-        return JSONResponse(content=results)
+        return ORJSONResponse(content=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/review/file-path")
+@app.post("/api/review/file-path", response_model=None)
 async def review_file_path(file_path: str = Form(...)):
     """
     Review code from file path on server
     """
     try:
         # Determine if it's a diff file
-        is_diff = (
-            file_path.endswith('.diff') or 
-            file_path.endswith('.patch') or 
-            'diff' in file_path.lower()
-        )
-        
-        if is_diff:
-            results = analyze_diff(file_path)
+        if is_diff_path(file_path):
+            results = await to_thread.run_sync(analyze_diff, file_path)
         else:
-            results = analyze_file(file_path)
+            results = await to_thread.run_sync(analyze_file, file_path)
         
         # Save results
         if "error" not in results:
             save_results(results)
         
-        return JSONResponse(content=results)
+        return ORJSONResponse(content=results)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"File not found: {file_path}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/fix/apply")
-async def apply_fix(request: ApplyFixRequest):
+@app.post("/api/fix/apply", response_model=None)
+async def apply_fix(request: ApplyFixRequest = Depends(json_body(ApplyFixRequest))):
     """
     Apply a fix to a file
     """
     try:
-        success, message = apply_fix_to_file(request.file_path, request.issue)
+        success, message = await to_thread.run_sync(apply_fix_to_file, request.file_path, request.issue)
         
         if success:
-            return JSONResponse(content={"success": True, "message": message})
+            return ORJSONResponse(content={"success": True, "message": message})
         else:
             raise HTTPException(status_code=400, detail=message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/results")
+RESULTS_DIR = Path(__file__).parent.parent / "results"
+
+# (directory mtime_ns, [(file mtime_ns, path)] newest first); adding or removing
+# a file bumps the directory mtime, so the listing is rebuilt only when it changes
+_results_listing = (None, [])
+
+
+def _list_result_files() -> List[Tuple[int, str]]:
+    """Return (mtime_ns, path) for saved review files, newest first."""
+    global _results_listing
+    
+    try:
+        dir_mtime = RESULTS_DIR.stat().st_mtime_ns
+    except FileNotFoundError:
+        return []
+    
+    cached_mtime, files = _results_listing
+    if cached_mtime == dir_mtime:
+        return files
+    
+    files = []
+    with os.scandir(RESULTS_DIR) as it:
+        for entry in it:
+            if entry.name.startswith("review_") and entry.name.endswith(".json") and entry.is_file():
+                files.append((entry.stat().st_mtime_ns, entry.path))
+    files.sort(reverse=True)
+    
+    _results_listing = (dir_mtime, files)
+    return files
+
+
+@lru_cache(maxsize=256)
+def _load_result(path: str, mtime_ns: int) -> dict:
+    """Parse a saved review; a new mtime_ns makes a new cache entry."""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def _load_recent_results(limit: int) -> List[dict]:
+    """Read the newest saved reviews, skipping unreadable files."""
+    results = []
+    for mtime_ns, file_path in _list_result_files()[:limit]:
+        try:
+            data = dict(_load_result(file_path, mtime_ns))
+        except Exception:
+            continue
+        data['review_file'] = os.path.basename(file_path)
+        results.append(data)
+    return results
+
+
+@app.get("/api/results", response_model=None)
 async def get_recent_results(limit: int = 10):
     """
     Get recent review results
     """
     try:
-        import json
-        from pathlib import Path
-        import datetime
-        
-        results_dir = Path(__file__).parent.parent / "results"
-        results_files = sorted(results_dir.glob("review_*.json"), key=lambda x: x.stat().st_mtime, reverse=True)
-        
-        results = []
-        for file_path in results_files[:limit]:
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    data['review_file'] = file_path.name
-                    results.append(data)
-            except Exception:
-                continue
-        
-        return JSONResponse(content={"results": results})
+        results = await to_thread.run_sync(_load_recent_results, limit)
+        return ORJSONResponse(content={"results": results})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/review/git")
-async def review_git_repo(request: GitReviewRequest):
+@app.post("/api/review/git", response_model=None)
+async def review_git_repo(request: GitReviewRequest = Depends(json_body(GitReviewRequest))):
     """
     Review a git repository by analyzing the diff
     """
     try:
-        results = analyze_git_repo(request.repo_path, request.base_ref, request.head_ref)
+        results = await to_thread.run_sync(analyze_git_repo, request.repo_path, request.base_ref, request.head_ref)
         
         # Save results
         if "error" not in results:
             save_results(results)
         
-        return JSONResponse(content=results)
+        return ORJSONResponse(content=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/review/directory")
-async def review_directory(request: DirectoryReviewRequest):
+@app.post("/api/review/directory", response_model=None)
+async def review_directory(request: DirectoryReviewRequest = Depends(json_body(DirectoryReviewRequest))):
     """
     Review all code files in a directory
     """
     try:
-        results = analyze_directory(request.directory, request.max_files)
+        # Batch jobs are not waited for here; poll /api/review/batch/status
+        results = await to_thread.run_sync(analyze_directory, request.directory, request.max_files, None, False)
         
         # Save results
-        if "error" not in results:
+        if "error" not in results and not results.get('in_progress'):
             save_results(results)
         
-        return JSONResponse(content=results)
+        return ORJSONResponse(content=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/review/multiple")
-async def review_multiple_files(request: MultipleFilesRequest):
+@app.post("/api/review/multiple", response_model=None)
+async def review_multiple_files(request: MultipleFilesRequest = Depends(json_body(MultipleFilesRequest))):
     """
     Review multiple files at once
     """
     try:
-        results = analyze_multiple_files(request.file_paths)
+        results = await analyze_multiple_files_async(request.file_paths, wait_for_batch=False)
         
         # Save results
-        if "error" not in results:
+        if "error" not in results and not results.get('in_progress'):
             save_results(results)
         
-        return JSONResponse(content=results)
+        return ORJSONResponse(content=results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/review/multiple-upload")
+@app.post("/api/review/multiple-upload", response_model=None)
 async def review_multiple_upload(files: List[UploadFile] = File(...)):
     """
     Review multiple uploaded files at once
     """
     try:
-        import tempfile
-        
         file_paths = []
-        temp_files = []
         
         # Save uploaded files temporarily
         for file in files:
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}")
-            temp_files.append(temp_file)
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.close()
-            file_paths.append(temp_file.name)
+            file_paths.append(await _spool_upload(file))
         
         try:
-            results = analyze_multiple_files(file_paths)
+            results = await analyze_multiple_files_async(file_paths, wait_for_batch=False)
             
             # Save results
-            if "error" not in results:
+            if "error" not in results and not results.get('in_progress'):
                 save_results(results)
             
-            return JSONResponse(content=results)
+            return ORJSONResponse(content=results)
         finally:
             # Clean up temp files
-            for temp_file in temp_files:
+            for temp_path in file_paths:
                 try:
-                    os.unlink(temp_file.name)
+                    os.unlink(temp_path)
                 except:
                     pass
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/files/list")
+@app.post("/api/review/batch/status", response_model=None)
+async def review_batch_status(request: BatchStatusRequest = Depends(json_body(BatchStatusRequest))):
+    """
+    Check a batch review job returned under "batch_job" by a review endpoint
+    """
+    try:
+        batch = await to_thread.run_sync(get_batch_review, request.batch_job)
+        
+        # Save results once the job has finished
+        if "results" in batch:
+            save_results(batch['results'])
+        
+        return ORJSONResponse(content=batch)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/files/list", response_model=None)
 async def list_code_files(directory: str, extensions: Optional[str] = None):
     """
     List code files in a directory
     """
     try:
         ext_list = extensions.split(',') if extensions else None
-        files = get_code_files(directory, ext_list)
-        return JSONResponse(content={"files": files, "count": len(files)})
+        files = await to_thread.run_sync(get_code_files, directory, ext_list)
+        return ORJSONResponse(content={"files": files, "count": len(files)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -5,17 +5,27 @@ Analyzes code files or diffs and provides suggestions.
 """
 
 import os
-import json
-import boto3
+import asyncio
+import copy
+import hashlib
+import threading
 import re
+import shutil
 import subprocess
+import time
 import glob
+import random
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from statistics import fmean
+from typing import Callable, Dict, List, Optional, Tuple
+import orjson
 from dotenv import load_dotenv
-from rich.console import Console
-from rich.panel import Panel
-from rich.syntax import Syntax
 
 # Load .env file from the project root
 env_path = Path(__file__).parent / '.env'
@@ -23,204 +33,1186 @@ load_dotenv(dotenv_path=env_path, override=True)
 # Also try loading from current directory
 load_dotenv(override=False)
 
-console = Console()
+
+class _LazyConsole:
+    """Stand-in for the module console that defers importing rich."""
+    
+    _console = None
+    _lock = threading.Lock()
+    
+    def __getattr__(self, name):
+        # Double-checked so concurrent first prints create a single Console
+        if self._console is None:
+            with self._lock:
+                if self._console is None:
+                    from rich.console import Console
+                    type(self)._console = Console()
+        return getattr(self._console, name)
+
+
+console = _LazyConsole()
+
+# Leading/trailing whitespace and quotes, stripped in a single pass
+_CREDENTIAL_TRIM_RE = re.compile(r'^[\s\'"]+|[\s\'"]+$')
+
 
 def sanitize_credential(value: Optional[str]) -> Optional[str]:
     """Remove quotes and whitespace from credentials."""
     if not value:
         return None
-    # Remove surrounding quotes (single or double)
-    value = value.strip().strip('"').strip("'")
-    # Remove any remaining whitespace
-    value = value.strip()
+    value = _CREDENTIAL_TRIM_RE.sub('', value)
     return value if value else None
 
-# Initialize Bedrock client
-try:
+
+@dataclass(frozen=True)
+class AWSSettings:
+    """AWS configuration read from the environment."""
+    region: str
+    access_key: Optional[str]
+    secret_key: Optional[str]
+    session_token: Optional[str]
+    model_id: str
+    
+    @property
+    def is_temporary(self) -> bool:
+        """Temporary credentials (ASIA prefix) require a session token."""
+        return bool(self.access_key and self.access_key.startswith("ASIA"))
+
+
+@lru_cache(maxsize=None)
+def load_aws_settings() -> AWSSettings:
+    """Read and sanitize AWS settings from the environment once per process."""
     # Try multiple environment variable names for compatibility
-    aws_region = sanitize_credential(os.getenv("AWS_REGION")) or sanitize_credential(os.getenv("AWS_DEFAULT_REGION")) or "us-east-1"
-    aws_key = sanitize_credential(os.getenv("AWS_ACCESS_KEY_ID")) or sanitize_credential(os.getenv("AWS_ACCESS_KEY"))
-    aws_secret = sanitize_credential(os.getenv("AWS_SECRET_ACCESS_KEY")) or sanitize_credential(os.getenv("AWS_SECRET_KEY"))
-    aws_session_token = sanitize_credential(os.getenv("AWS_SESSION_TOKEN")) or sanitize_credential(os.getenv("AWS_SECURITY_TOKEN"))
+    return AWSSettings(
+        region=sanitize_credential(os.getenv("AWS_REGION")) or sanitize_credential(os.getenv("AWS_DEFAULT_REGION")) or "us-east-1",
+        access_key=sanitize_credential(os.getenv("AWS_ACCESS_KEY_ID")) or sanitize_credential(os.getenv("AWS_ACCESS_KEY")),
+        secret_key=sanitize_credential(os.getenv("AWS_SECRET_ACCESS_KEY")) or sanitize_credential(os.getenv("AWS_SECRET_KEY")),
+        session_token=sanitize_credential(os.getenv("AWS_SESSION_TOKEN")) or sanitize_credential(os.getenv("AWS_SECURITY_TOKEN")),
+        model_id=os.getenv("MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+    )
+
+
+# botocore Config options shared by every client. The pool must cover
+# REVIEW_CONCURRENCY or parallel reviews queue for a connection, and a full
+# 4000-token review can take longer than botocore's 60s default read timeout.
+AWS_CLIENT_OPTIONS = {
+    "connect_timeout": int(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5")),
+    "read_timeout": int(os.getenv("BEDROCK_READ_TIMEOUT", "120")),
+    "retries": {"max_attempts": int(os.getenv("BEDROCK_RETRIES", "3")), "mode": "adaptive"},
+    "max_pool_connections": int(os.getenv("BEDROCK_POOL", "32")),
+    "tcp_keepalive": True
+}
+# Bedrock runtime calls are retried by _call_bedrock, so botocore makes a
+# single attempt there instead of multiplying the retries underneath it
+AWS_SERVICE_RETRIES = {
+    "bedrock-runtime": {"total_max_attempts": 1, "mode": "standard"},
+}
+
+
+@lru_cache(maxsize=None)
+def get_aws_session():
+    """
+    Create the boto3 Session shared by every AWS client.
     
-    # Check if using temporary credentials (ASIA prefix requires session token)
-    is_temporary_credential = aws_key and aws_key.startswith("ASIA")
+    Credentials are resolved once here rather than once per client.
     
-    if is_temporary_credential and not aws_session_token:
+    Returns:
+        boto3 Session, or None if the configured credentials are unusable
+    """
+    # boto3/botocore are slow to import, so load them on first use
+    import boto3
+    
+    settings = load_aws_settings()
+    
+    if settings.is_temporary and not settings.session_token:
         console.print("[bold red]⚠️  Error: Temporary credentials detected (ASIA prefix) but AWS_SESSION_TOKEN is missing![/bold red]")
         console.print("[dim]Temporary credentials require AWS_SESSION_TOKEN. Add it to your .env file or use permanent credentials (AKIA prefix)[/dim]")
-        bedrock = None
-    elif not aws_key or not aws_secret:
+        return None
+    elif not settings.access_key or not settings.secret_key:
         console.print("[bold yellow]⚠️  Warning: AWS credentials not found in environment variables[/bold yellow]")
         console.print("[dim]Trying to use default AWS credential chain (AWS CLI, IAM roles, etc.)[/dim]")
-        # Try without explicit credentials (use default AWS credential chain)
-        bedrock = boto3.client(
-            "bedrock-runtime",
-            region_name=aws_region
-        )
-    else:
-        # Use explicit credentials
-        client_params = {
-            "service_name": "bedrock-runtime",
-            "region_name": aws_region,
-            "aws_access_key_id": aws_key,
-            "aws_secret_access_key": aws_secret
-        }
+        # Use the default AWS credential chain
+        return boto3.Session(region_name=settings.region)
+    
+    # Use explicit credentials, plus the session token for temporary ones
+    return boto3.Session(
+        aws_access_key_id=settings.access_key,
+        aws_secret_access_key=settings.secret_key,
+        aws_session_token=settings.session_token,
+        region_name=settings.region
+    )
+
+
+# Clients by service name (None if creation failed). The lock also
+# serializes client creation, as boto3 Sessions are not thread-safe there.
+_aws_clients: Dict[str, object] = {}
+_aws_client_lock = threading.Lock()
+
+
+# Seconds before settings, session and clients are rebuilt from a reloaded
+# .env, for long-running processes whose temporary credentials rotate;
+# 0 keeps them for the life of the process
+AWS_SETTINGS_TTL = int(os.getenv("AWS_SETTINGS_TTL", "0"))
+_aws_settings_loaded_at = time.monotonic()
+_aws_refresh_lock = threading.Lock()
+
+
+def refresh_aws_settings():
+    """Reload .env and rebuild AWS settings, session and clients on next use."""
+    global _aws_settings_loaded_at
+    
+    load_dotenv(dotenv_path=env_path, override=True)
+    with _aws_client_lock:
+        load_aws_settings.cache_clear()
+        get_aws_session.cache_clear()
+        _aws_clients.clear()
+        _aws_settings_loaded_at = time.monotonic()
+
+
+def _refresh_if_stale():
+    if not AWS_SETTINGS_TTL or time.monotonic() - _aws_settings_loaded_at < AWS_SETTINGS_TTL:
+        return
+    with _aws_refresh_lock:
+        # Another thread may have refreshed while this one waited
+        if time.monotonic() - _aws_settings_loaded_at >= AWS_SETTINGS_TTL:
+            refresh_aws_settings()
+
+
+def get_aws_client(service_name: str):
+    """
+    Return the shared client for an AWS service.
+    
+    Clients are created once per service and reused; with AWS_SETTINGS_TTL
+    set they are rebuilt from fresh settings once it has elapsed.
+    
+    Args:
+        service_name: boto3 service name (e.g. "bedrock-runtime", "s3")
+    
+    Returns:
+        boto3 client, or None if it could not be initialized
+    """
+    _refresh_if_stale()
+    try:
+        return _aws_clients[service_name]
+    except KeyError:
+        pass
+    
+    # Only the first of several concurrent callers resolves credentials and
+    # builds the client; the rest wait and reuse it
+    with _aws_client_lock:
+        if service_name not in _aws_clients:
+            _aws_clients[service_name] = _create_aws_client(service_name)
+        return _aws_clients[service_name]
+
+
+def _create_aws_client(service_name: str):
+    # Caller holds _aws_client_lock
+    try:
+        from botocore.config import Config
+        
+        session = get_aws_session()
+        if session is None:
+            return None
         
-        # Add session token if present (for temporary credentials)
-        if aws_session_token:
-            client_params["aws_session_token"] = aws_session_token
+        options = dict(AWS_CLIENT_OPTIONS)
+        if service_name in AWS_SERVICE_RETRIES:
+            options["retries"] = AWS_SERVICE_RETRIES[service_name]
+        return session.client(service_name, config=Config(**options))
+    except Exception as e:
+        console.print(f"[bold red]Error initializing {service_name} client: {e}[/bold red]")
+        console.print("[dim]Tip: Check your .env file format - credentials should not have quotes around them[/dim]")
+        return None
+
+
+def get_bedrock_client():
+    """Return the shared Bedrock runtime client (None if unavailable)."""
+    return get_aws_client("bedrock-runtime")
+
+
+MODEL_ID = load_aws_settings().model_id
+
+# Upper bound on the length of each review response
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "4000"))
+# The model's own output limit (4096 for Claude 3; raise it for newer
+# models), which caps max_tokens for packed multi-file reviews
+MODEL_MAX_OUTPUT_TOKENS = int(os.getenv("MODEL_MAX_OUTPUT_TOKENS", "4096"))
+
+# Batch inference settings (optional - only needed for analyze_files_batch)
+BATCH_S3_URI = os.getenv("BEDROCK_BATCH_S3_URI")
+BATCH_ROLE_ARN = os.getenv("BEDROCK_BATCH_ROLE_ARN")
+BATCH_MIN_RECORDS = int(os.getenv("BEDROCK_BATCH_MIN_RECORDS", "100"))
+# How long a blocking batch review waits for its job, and how many status
+# checks in a row may fail before it stops waiting
+BATCH_TIMEOUT = float(os.getenv("BEDROCK_BATCH_TIMEOUT", "21600"))
+BATCH_POLL_RETRIES = int(os.getenv("BEDROCK_BATCH_POLL_RETRIES", "5"))
+
+
+# Static review instructions, sent ahead of the code so they form a
+# cacheable prompt prefix
+REVIEW_SYSTEM_PROMPT = """You are an expert AI code reviewer. Analyze the code you are given and provide a comprehensive review.
+
+Please provide your review in the following JSON format:
+{
+    "summary": "Brief summary of the review",
+    "issues": [
+        {
+            "type": "bug|style|documentation|performance|security",
+            "severity": "high|medium|low",
+            "line": <line_number>,
+            "message": "Description of the issue",
+            "suggestion": "Code suggestion in markdown format with ```suggestion blocks"
+        }
+    ],
+    "missing_docstrings": [
+        {
+            "function": "function_name",
+            "line": <line_number>,
+            "suggestion": "Suggested docstring"
+        }
+    ],
+    "overall_score": <score_out_of_10>
+}
+
+Focus on:
+1. Code style and formatting issues
+2. Missing function/method docstrings
+3. Potential bugs or logical errors
+4. Performance improvements
+5. Security concerns
+6. Best practices violations
+
+Return ONLY valid JSON, no additional text."""
+
+# Prompt caching is only accepted by newer Claude models on Bedrock
+PROMPT_CACHING = os.getenv("BEDROCK_PROMPT_CACHING", "").lower() in ("1", "true", "yes")
+
+
+def _system_blocks() -> List[Dict]:
+    """Build the system prompt blocks, marked as a cache prefix when enabled."""
+    system_block = {"type": "text", "text": REVIEW_SYSTEM_PROMPT}
+    if PROMPT_CACHING:
+        system_block["cache_control"] = {"type": "ephemeral"}
+    return [system_block]
+
+
+# Identical for every request, so built once and shared by all bodies
+SYSTEM_BLOCKS = _system_blocks()
+
+# Static part of every request body; only the user message varies per call
+_BODY_TEMPLATE = {
+    "anthropic_version": "bedrock-2023-05-31",
+    "max_tokens": MAX_OUTPUT_TOKENS,
+    "system": SYSTEM_BLOCKS,
+}
+REVIEW_PROMPT_PREFIX = "Code to review:\n"
+
+
+def _messages_body(user_content: str) -> Dict:
+    """Build a Claude 3 messages request body around the review instructions."""
+    return {
+        **_BODY_TEMPLATE,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": user_content}]
+            }
+        ]
+    }
+
+
+# Input is capped so one huge file can't dominate latency and cost
+REVIEW_MAX_CHARS = int(os.getenv("REVIEW_MAX_CHARS", "40000"))
+
+
+def _fit_review_input(code: str, limit: int = REVIEW_MAX_CHARS) -> str:
+    """
+    Trim code to at most about limit characters for the review prompt.
+    
+    Trailing whitespace is dropped. Longer code keeps its head and tail
+    around a marker giving the line number the tail resumes at, so the
+    line numbers Claude reports still match the original file.
+    
+    Args:
+        code: Code or diff to review
+        limit: Maximum number of characters to send
+    
+    Returns:
+        The code, truncated if necessary
+    """
+    code = code.rstrip()
+    if len(code) <= limit:
+        if len(code) > limit * 0.8:
+            console.print(f"[yellow]Review input is ~{len(code) // 4} tokens, close to the ~{limit // 4} token limit[/yellow]")
+        return code
+    
+    # Cut at line boundaries so no partial lines are sent
+    half = limit // 2
+    head_end = code.rfind('\n', 0, half)
+    head_end = half if head_end == -1 else head_end
+    tail_start = code.find('\n', len(code) - half) + 1 or len(code) - half
+    tail_line = code.count('\n', 0, tail_start) + 1
+    omitted = tail_start - head_end
+    
+    console.print(f"[yellow]Review input truncated: {omitted} of {len(code)} characters omitted[/yellow]")
+    return (f"{code[:head_end]}\n\n"
+            f"... [input truncated: {omitted} of {len(code)} characters omitted; "
+            f"the code below resumes at line {tail_line}] ...\n\n"
+            f"{code[tail_start:]}")
+
+
+def build_request_body(code_diff: str) -> Dict:
+    """Build the Claude 3 messages request body for Bedrock."""
+    return _messages_body(REVIEW_PROMPT_PREFIX + _fit_review_input(code_diff))
+
+
+PACKED_REVIEW_INSTRUCTIONS = """Review each file below separately. Return ONLY valid JSON of the form {"reviews": [...]}, with one review per file in the format above plus a "file_path" field matching the file's path attribute."""
+
+
+def build_packed_request_body(files: List[Tuple[str, str]]) -> Dict:
+    """Build one request body reviewing several (path, code) files at once."""
+    file_blocks = "\n\n".join(f'<file path="{path}">\n{code}\n</file>' for path, code in files)
+    body = _messages_body(f"{PACKED_REVIEW_INSTRUCTIONS}\n\n{file_blocks}")
+    # pack_files keeps len(files) * PACK_OUTPUT_TOKENS within the model's limit
+    body["max_tokens"] = min(PACK_OUTPUT_TOKENS * len(files), MODEL_MAX_OUTPUT_TOKENS)
+    return body
+
+
+def _complete_packed_reviews(text: str) -> List[Dict]:
+    """
+    Parse the reviews a packed reply finished before it was cut off.
+    
+    Scans the "reviews" array for complete top-level objects, tracking
+    strings so braces inside review text don't count.
+    
+    Args:
+        text: Packed reply text, possibly truncated
+    
+    Returns:
+        List of the review objects that parsed
+    """
+    start = text.find('"reviews"')
+    start = text.find('[', start) if start != -1 else -1
+    if start == -1:
+        return []
+    
+    reviews = []
+    depth = 0
+    object_start = 0
+    in_string = False
+    escaped = False
+    for i in range(start + 1, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            if depth == 0:
+                object_start = i
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                try:
+                    reviews.append(orjson.loads(text[object_start:i + 1]))
+                except orjson.JSONDecodeError:
+                    pass
+        elif ch == ']' and depth == 0:
+            break
+    return reviews
+
+
+# First ```json (or bare ```) block, closed by a fence on its own line so
+# ```suggestion fences inside the review don't end it; tolerates a missing
+# closing fence
+_JSON_FENCE_RE = re.compile(r'```(?:json)?[ \t]*\n(.*?)(?:^```[ \t]*$|\Z)', re.DOTALL | re.MULTILINE)
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+
+def _repair_review_json(text: str):
+    """
+    Recover a JSON object from a reply that strict parsing rejected.
+    
+    Drops any prose around the outermost braces and trailing commas
+    before closing brackets, the two slips Claude makes most often.
+    
+    Args:
+        text: Reply text that failed to parse
+    
+    Returns:
+        The parsed value, or None if it still isn't valid JSON
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        return orjson.loads(_TRAILING_COMMA_RE.sub(r'\1', text[start:end + 1]))
+    except orjson.JSONDecodeError:
+        return None
+
+
+def _validate_review(result: Dict) -> Dict:
+    """
+    Coerce a parsed review into the shape the rest of the agent relies on.
+    
+    Args:
+        result: Review dictionary parsed from Claude's reply
+    
+    Returns:
+        The same dictionary with list fields and the score made safe to use
+    """
+    for field in ('issues', 'missing_docstrings'):
+        entries = result.get(field)
+        result[field] = [e for e in entries if isinstance(e, dict)] if isinstance(entries, list) else []
+    
+    score = result.get('overall_score')
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            score = 5
+    result['overall_score'] = score
+    result.setdefault('summary', 'Review completed')
+    return result
+
+
+def parse_review_response(response_body: Dict, file_path: Optional[str] = None) -> Dict:
+    """
+    Turn a Claude response body into a review result dictionary.
+    
+    Args:
+        response_body: Decoded Claude messages response
+        file_path: Optional file path for context
+    
+    Returns:
+        Dictionary containing suggestions and analysis
+    """
+    # Extract the content from Claude's response
+    content = response_body.get('content', [])
+    if not content:
+        return {
+            "error": "No content in response",
+            "suggestions": []
+        }
+    
+    reply = content[0].get('text', '')
+    text_content = reply
+    
+    # Try to parse JSON from the response
+    try:
+        # Extract JSON from markdown code blocks if present; the substring
+        # test skips the regex for bare JSON replies, and orjson ignores the
+        # surrounding whitespace so nothing is stripped before parsing
+        if '```' in text_content:
+            fence = _JSON_FENCE_RE.search(text_content)
+            if fence:
+                text_content = fence.group(1)
         
-        bedrock = boto3.client(**client_params)
-except Exception as e:
-    console.print(f"[bold red]Error initializing Bedrock client: {e}[/bold red]")
-    console.print("[dim]Tip: Check your .env file format - credentials should not have quotes around them[/dim]")
-    bedrock = None
+        result = orjson.loads(text_content)
+    except orjson.JSONDecodeError:
+        # Repair the whole reply, not the fenced slice, in case the fence
+        # was cut short
+        result = _repair_review_json(reply)
+    
+    if isinstance(result, dict):
+        # Packed replies wrap one review per file; those are checked per file
+        if 'reviews' not in result:
+            _validate_review(result)
+        result['file_path'] = file_path
+        return result
+    
+    # Fallback: return as text if JSON parsing fails
+    return {
+        "summary": "Review completed",
+        "raw_response": text_content.strip(),
+        "issues": [],
+        "missing_docstrings": [],
+        "file_path": file_path,
+        "overall_score": 5
+    }
+
+
+def format_bedrock_error(e: Exception) -> str:
+    """Format a Bedrock exception with troubleshooting tips where useful."""
+    error_msg = str(e)
+    
+    # Provide helpful error messages
+    if "UnrecognizedClientException" in error_msg or "invalid" in error_msg.lower():
+        error_msg += "\n\n💡 Troubleshooting tips:\n"
+        error_msg += "1. Check your AWS credentials in .env file\n"
+        error_msg += "2. Ensure credentials don't have quotes around them (e.g., use KEY=value not KEY='value')\n"
+        error_msg += "3. Verify credentials are valid and not expired\n"
+        error_msg += "4. Check that Bedrock is enabled in your AWS account\n"
+        error_msg += "5. Verify the AWS region is correct\n"
+    
+    return error_msg
 
-MODEL_ID = os.getenv("MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
 
+# Bump when the prompt or response format changes to invalidate cached reviews
+PROMPT_VERSION = "2"
+REVIEW_CACHE_SIZE = int(os.getenv("REVIEW_CACHE_SIZE", "256"))
+# Reviews are also persisted here so they survive restarts
+REVIEW_CACHE_DIR = Path(os.getenv("REVIEW_CACHE_DIR", str(Path(__file__).parent / "results" / ".cache")))
+REVIEW_CACHE_TTL = int(os.getenv("REVIEW_CACHE_TTL", str(7 * 24 * 60 * 60)))
 
-def analyze_code(code_diff: str, file_path: Optional[str] = None) -> Dict:
+_review_cache: "OrderedDict[str, Dict]" = OrderedDict()
+# file path -> (mtime_ns, size, review cache key), to skip re-reading unchanged files
+_file_review_keys: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+_review_cache_lock = threading.Lock()
+# review cache key -> Future for reviews currently being fetched
+_inflight_reviews: Dict[str, Future] = {}
+
+
+def review_cache_key(code_diff: str) -> str:
+    """Content-address a review by code, model and prompt version."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{MODEL_ID}\0{PROMPT_VERSION}\0".encode('utf-8'))
+    digest.update(code_diff.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _lru_put(cache: OrderedDict, key, value):
+    # Caller holds _review_cache_lock
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > REVIEW_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _review_cache_get(key: str) -> Optional[Dict]:
+    with _review_cache_lock:
+        result = _review_cache.get(key)
+        if result is not None:
+            _review_cache.move_to_end(key)
+    
+    if result is None:
+        cache_path = REVIEW_CACHE_DIR / f"{key}.json"
+        try:
+            if time.time() - cache_path.stat().st_mtime > REVIEW_CACHE_TTL:
+                cache_path.unlink()
+                return None
+            with open(cache_path, 'rb') as f:
+                result = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        with _review_cache_lock:
+            _lru_put(_review_cache, key, result)
+    
+    # Callers annotate results in place, so never hand out the cached dict
+    return copy.deepcopy(result)
+
+
+def _write_file_atomic(path: str, data: bytes):
+    """Write data to path via a temp file and rename, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates owner-only files; keep the usual 0644 for saved files
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _is_cacheable(result: Dict) -> bool:
+    """Only reviews that parsed are cached; errors and raw-text fallbacks are retried."""
+    return "error" not in result and "raw_response" not in result
+
+
+def _review_cache_put(key: str, result: Dict):
+    if not _is_cacheable(result):
+        return
+    result = copy.deepcopy(result)
+    with _review_cache_lock:
+        _lru_put(_review_cache, key, result)
+    
+    # Write atomically so concurrent readers never see a partial file
+    try:
+        REVIEW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        _write_file_atomic(str(REVIEW_CACHE_DIR / f"{key}.json"), orjson.dumps(result))
+    except OSError as e:
+        console.print(f"[dim]Could not persist review cache entry: {e}[/dim]")
+
+
+def clear_review_cache(expired_only: bool = False) -> int:
+    """
+    Drop cached reviews from memory and from REVIEW_CACHE_DIR.
+    
+    Args:
+        expired_only: Only remove disk entries older than REVIEW_CACHE_TTL,
+            keeping the in-memory tiers
+    
+    Returns:
+        Number of cache files removed
+    """
+    if not expired_only:
+        with _review_cache_lock:
+            _review_cache.clear()
+            _file_review_keys.clear()
+    
+    removed = 0
+    cutoff = time.time() - REVIEW_CACHE_TTL
+    try:
+        entries = list(os.scandir(REVIEW_CACHE_DIR))
+    except OSError:
+        return removed
+    for entry in entries:
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            if not expired_only or entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def _read_for_review(file_path: str, errors: str = 'strict') -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Read a file for review, skipping the read if it is unchanged and cached.
+    
+    Args:
+        file_path: Path of the file to read
+        errors: How to handle bytes that are not valid UTF-8, as for open()
+    
+    Returns:
+        Tuple of (content, cached result); exactly one of them is None
+    """
+    stat = os.stat(file_path)
+    with _review_cache_lock:
+        known = _file_review_keys.get(file_path)
+    if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+        cached = _review_cache_get(known[2])
+        if cached is not None:
+            cached['file_path'] = file_path
+            return None, cached
+    
+    with open(file_path, 'r', encoding='utf-8', errors=errors) as f:
+        content = f.read()
+    key = review_cache_key(content)
+    with _review_cache_lock:
+        _lru_put(_file_review_keys, file_path, (stat.st_mtime_ns, stat.st_size, key))
+    # The same code may have been reviewed under another path or process
+    cached = _review_cache_get(key)
+    if cached is not None:
+        cached['file_path'] = file_path
+        return None, cached
+    return content, None
+
+
+BEDROCK_THROTTLE_RETRIES = int(os.getenv("BEDROCK_THROTTLE_RETRIES", "7"))
+BEDROCK_BACKOFF_MAX = float(os.getenv("BEDROCK_BACKOFF_MAX", "30"))
+# Client-side cap on requests per minute across all threads (0 = unlimited)
+BEDROCK_RPM = float(os.getenv("BEDROCK_RPM", "0"))
+RETRYABLE_ERROR_CODES = frozenset({
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+    'InternalServerException',
+})
+
+_rate_lock = threading.Lock()
+_rate_next_slot = 0.0
+
+
+def _wait_for_rate_limit():
+    """Block until the next request slot allowed by BEDROCK_RPM is reached."""
+    global _rate_next_slot
+    if BEDROCK_RPM <= 0:
+        return
+    
+    # Each caller reserves the next free slot under the lock and sleeps
+    # outside it, so requests are spaced evenly without serializing threads
+    with _rate_lock:
+        now = time.monotonic()
+        slot = max(now, _rate_next_slot)
+        _rate_next_slot = slot + 60.0 / BEDROCK_RPM
+    if slot > now:
+        time.sleep(slot - now)
+
+
+def _call_bedrock(method: Callable, **kwargs):
+    """
+    Call a Bedrock client method, backing off with jitter while throttled.
+    
+    This is the only retry layer for Bedrock runtime calls; the client itself
+    makes a single attempt (see AWS_SERVICE_RETRIES).
+    """
+    from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError
+    
+    for attempt in range(BEDROCK_THROTTLE_RETRIES + 1):
+        _wait_for_rate_limit()
+        try:
+            return method(**kwargs)
+        except (ClientError, BotoConnectionError) as e:
+            # Failed connections never reached Bedrock, so they are safe to retry
+            retryable = (isinstance(e, BotoConnectionError)
+                         or e.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES)
+            if not retryable or attempt == BEDROCK_THROTTLE_RETRIES:
+                raise
+            time.sleep(min(BEDROCK_BACKOFF_MAX, 0.5 * 2 ** attempt + random.random()))
+
+
+# Stream responses by default: text arrives as it is generated and the read
+# timeout applies between chunks rather than to the whole review
+BEDROCK_STREAMING = os.getenv("BEDROCK_STREAMING", "true").lower() in ("1", "true", "yes")
+
+
+def _stream_review(bedrock, body: bytes, text_parts: List[str],
+                   on_text: Optional[Callable[[str], None]] = None):
+    """Stream a review into text_parts, raising on an in-stream error event."""
+    from botocore.exceptions import EventStreamError
+    
+    response = _call_bedrock(
+        bedrock.invoke_model_with_response_stream,
+        modelId=MODEL_ID,
+        body=body
+    )
+    
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            # Errors mid-stream arrive as events such as throttlingException
+            for name, details in event.items():
+                if name.endswith('Exception'):
+                    error = {'Code': name, 'Message': details.get('message', str(details))}
+                    raise EventStreamError({'Error': error}, 'InvokeModelWithResponseStream')
+            continue
+        payload = orjson.loads(chunk['bytes'])
+        if payload.get('type') == 'content_block_delta':
+            text = payload.get('delta', {}).get('text', '')
+            text_parts.append(text)
+            if on_text is not None:
+                on_text(text)
+
+
+def _invoke_review(bedrock, request: Dict,
+                   on_text: Optional[Callable[[str], None]] = None) -> Dict:
+    """Send a review request body to Bedrock and return the decoded response body."""
+    body = orjson.dumps(request)
+    
+    if on_text is not None or BEDROCK_STREAMING:
+        from botocore.exceptions import EventStreamError, HTTPClientError, IncompleteReadError
+        
+        text_parts = []
+        try:
+            _stream_review(bedrock, body, text_parts, on_text)
+            return {"content": [{"text": ''.join(text_parts)}]} if text_parts else {}
+        # Only failures of the stream itself are worth a non-streaming retry;
+        # other client errors (access denied, validation, throttling that
+        # _call_bedrock already retried) would fail the same way again
+        except (EventStreamError, HTTPClientError, IncompleteReadError) as e:
+            # Text already shown to the caller can't be taken back
+            if on_text is not None and text_parts:
+                raise
+            console.print(f"[dim]Streaming failed ({e}), retrying without streaming[/dim]")
+    
+    response = _call_bedrock(
+        bedrock.invoke_model,
+        modelId=MODEL_ID,
+        body=body
+    )
+    return orjson.loads(response['body'].read())
+
+
+def analyze_code(code_diff: str, file_path: Optional[str] = None,
+                 on_text: Optional[Callable[[str], None]] = None) -> Dict:
     """
     Analyze code using AWS Bedrock Claude model.
     
+    Identical code is only sent to Bedrock once; repeat reviews are served
+    from an in-memory LRU backed by JSON files in REVIEW_CACHE_DIR, and
+    concurrent reviews of the same code wait for the first one's result.
+    
     Args:
         code_diff: The code diff or file content to analyze
         file_path: Optional file path for context
+        on_text: Optional callback receiving each chunk of response text as it
+            is generated; when given, the response is streamed
     
     Returns:
         Dictionary containing suggestions and analysis
     """
+    cache_key = review_cache_key(code_diff)
+    cached = _review_cache_get(cache_key)
+    if cached is not None:
+        cached['file_path'] = file_path
+        return cached
+    
+    with _review_cache_lock:
+        inflight = _inflight_reviews.get(cache_key)
+        owner = inflight is None
+        if owner:
+            inflight = _inflight_reviews[cache_key] = Future()
+    
+    if not owner:
+        result = copy.deepcopy(inflight.result())
+        result['file_path'] = file_path
+        return result
+    
+    result = None
+    try:
+        result = _review_uncached(code_diff, file_path, on_text, cache_key)
+        return result
+    finally:
+        with _review_cache_lock:
+            del _inflight_reviews[cache_key]
+        # The caller may annotate its result, so waiters get their own copy
+        inflight.set_result(copy.deepcopy(result) if result is not None else {
+            "error": "Review failed",
+            "suggestions": []
+        })
+
+
+def _review_uncached(code_diff: str, file_path: Optional[str],
+                     on_text: Optional[Callable[[str], None]], cache_key: str) -> Dict:
+    """Call Bedrock for a review that missed the cache, and cache a success."""
+    bedrock = get_bedrock_client()
     if bedrock is None:
         return {
             "error": "Bedrock client not initialized",
             "suggestions": []
         }
     
-    # Construct the prompt for code review
-    prompt = f"""You are an expert AI code reviewer. Analyze the following code and provide a comprehensive review.
+    if on_text is None and len(code_diff) > REVIEW_MAX_CHARS:
+        windows = split_review_windows(code_diff)
+        if len(windows) <= REVIEW_MAX_WINDOWS:
+            result = _analyze_windows(bedrock, windows, file_path)
+            _review_cache_put(cache_key, result)
+            return result
+    
+    try:
+        response_body = _invoke_review(bedrock, build_request_body(code_diff), on_text)
+    except Exception as e:
+        console.print(f"[bold red]Error calling Bedrock: {e}[/bold red]")
+        return {
+            "error": format_bedrock_error(e),
+            "suggestions": []
+        }
+    
+    result = parse_review_response(response_body, file_path)
+    _review_cache_put(cache_key, result)
+    return result
+
+
+# Larger inputs are reviewed in up to this many REVIEW_MAX_CHARS windows;
+# beyond it they are truncated to their head and tail instead
+REVIEW_MAX_WINDOWS = int(os.getenv("REVIEW_MAX_WINDOWS", "8"))
+
+
+def split_review_windows(code: str, size: int = REVIEW_MAX_CHARS) -> List[Tuple[int, str]]:
+    """
+    Split code into windows of at most size characters at line boundaries.
+    
+    Args:
+        code: Code to split
+        size: Maximum window length in characters
+    
+    Returns:
+        List of (first line number, window text) tuples
+    """
+    windows = []
+    start = 0
+    line = 1
+    while start < len(code):
+        end = start + size
+        if end < len(code):
+            cut = code.rfind('\n', start, end)
+            if cut > start:
+                end = cut + 1
+        window = code[start:end]
+        windows.append((line, window))
+        line += window.count('\n')
+        start = end
+    return windows
+
+
+REVIEW_CONCURRENCY = int(os.getenv("REVIEW_CONCURRENCY", "8"))
+
+# Window calls from outside REVIEW_EXECUTOR (CLI, backend worker threads)
+# share this budget, so concurrent large-file reviews can't multiply it
+_window_slots = threading.BoundedSemaphore(REVIEW_CONCURRENCY)
+
+# Set on REVIEW_EXECUTOR workers by the executor's initializer
+_review_worker = threading.local()
+
+
+def _mark_review_worker():
+    _review_worker.active = True
+
+
+def _analyze_windows(bedrock, windows: List[Tuple[int, str]], file_path: Optional[str]) -> Dict:
+    """Review windows of one file, in parallel where allowed, and merge them into a single review."""
+    def review(part: int, first_line: int, window: str) -> Dict:
+        last_line = first_line + window.count('\n', 0, len(window) - 1)
+        request = _messages_body(
+            f"This is part {part} of {len(windows)} of {file_path or 'a file'}, "
+            f"lines {first_line}-{last_line}. Number lines from 1 at the start of this part.\n\n"
+            + REVIEW_PROMPT_PREFIX + window
+        )
+        result = parse_review_response(_invoke_review(bedrock, request), file_path)
+        # Shift window-relative line numbers back to file line numbers
+        for entry in result.get('issues', []) + result.get('missing_docstrings', []):
+            if isinstance(entry.get('line'), int):
+                entry['line'] += first_line - 1
+        result['lines'] = f"{first_line}-{last_line}"
+        return result
+    
+    def review_in_slot(args: Tuple[int, int, str]) -> Dict:
+        with _window_slots:
+            return review(*args)
+    
+    jobs = [(i + 1, first, window) for i, (first, window) in enumerate(windows)]
+    try:
+        if getattr(_review_worker, 'active', False):
+            # Already on a REVIEW_EXECUTOR worker, whose pool is the process-wide
+            # budget; fanning out here would multiply it, so go window by window
+            parts = [review(*args) for args in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(windows), REVIEW_CONCURRENCY)) as executor:
+                parts = list(executor.map(review_in_slot, jobs))
+    except Exception as e:
+        console.print(f"[bold red]Error calling Bedrock: {e}[/bold red]")
+        return {
+            "error": format_bedrock_error(e),
+            "suggestions": []
+        }
+    
+    for part in parts:
+        if "error" in part:
+            return part
+    
+    total_chars = sum(len(window) for _, window in windows)
+    score = sum((part.get('overall_score') if isinstance(part.get('overall_score'), (int, float)) else 0) * len(window)
+                for part, (_, window) in zip(parts, windows)) / total_chars
+    merged = {
+        "summary": " ".join(f"Lines {part['lines']}: {part.get('summary', '')}" for part in parts),
+        "issues": [issue for part in parts for issue in part.get('issues', [])],
+        "missing_docstrings": [doc for part in parts for doc in part.get('missing_docstrings', [])],
+        "overall_score": round(score, 1),
+        "file_path": file_path
+    }
+    # Keep the text of windows whose reply didn't parse, which also keeps
+    # the merged review out of the cache
+    raw_parts = [f"Lines {part['lines']}:\n{part['raw_response']}" for part in parts if "raw_response" in part]
+    if raw_parts:
+        merged["raw_response"] = "\n\n".join(raw_parts)
+    return merged
+
+
+async def analyze_code_async(code_diff: str, file_path: Optional[str] = None,
+                             on_text: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Awaitable analyze_code for use inside an event loop.
+    
+    The blocking call runs on REVIEW_EXECUTOR, so awaiting many reviews with
+    asyncio.gather overlaps them within the shared concurrency limit.
+    
+    Args:
+        code_diff: The code diff or file content to analyze
+        file_path: Optional file path for context
+        on_text: Optional streaming callback, called from a worker thread
+    
+    Returns:
+        Dictionary containing suggestions and analysis
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(REVIEW_EXECUTOR, analyze_code, code_diff, file_path, on_text)
+
+
+# Files are packed into one request up to this many estimated input tokens.
+# Every file in a pack also needs PACK_OUTPUT_TOKENS of the model's output
+# limit, so packs hold at most MODEL_MAX_OUTPUT_TOKENS // PACK_OUTPUT_TOKENS
+# files; otherwise replies get cut off and files are re-reviewed one by one.
+PACK_TOKEN_BUDGET = int(os.getenv("REVIEW_PACK_TOKENS", "12000"))
+PACK_OUTPUT_TOKENS = int(os.getenv("REVIEW_PACK_OUTPUT_TOKENS", "2000"))
+PACK_MAX_FILES = max(1, min(int(os.getenv("REVIEW_PACK_MAX_FILES", "4")),
+                            MODEL_MAX_OUTPUT_TOKENS // PACK_OUTPUT_TOKENS))
+
+
+def pack_files(files: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """
+    Group (path, code) files into packs that fit one review request.
+    
+    Token counts are estimated as len(code) // 4.
+    
+    Args:
+        files: List of (path, code) tuples
+    
+    Returns:
+        List of packs, each a list of (path, code) tuples
+    """
+    packs = []
+    current = []
+    current_tokens = 0
+    for path, code in files:
+        tokens = len(code) // 4
+        if current and (current_tokens + tokens > PACK_TOKEN_BUDGET or len(current) >= PACK_MAX_FILES):
+            packs.append(current)
+            current = []
+            current_tokens = 0
+        current.append((path, code))
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+def _analyze_pack(pack: List[Tuple[str, str]]) -> Dict[str, Dict]:
+    """Review one pack of files in a single Bedrock call, per file on failure."""
+    if len(pack) == 1:
+        path, code = pack[0]
+        return {path: analyze_code(code, path)}
+    
+    bedrock = get_bedrock_client()
+    if bedrock is None:
+        error = {"error": "Bedrock client not initialized", "suggestions": []}
+        return {path: dict(error) for path, _ in pack}
+    
+    reviews = {}
+    try:
+        response = _call_bedrock(
+            bedrock.invoke_model,
+            modelId=MODEL_ID,
+            body=orjson.dumps(build_packed_request_body(pack))
+        )
+        response_body = orjson.loads(response['body'].read())
+        packed = parse_review_response(response_body)
+        if 'reviews' in packed:
+            packed_reviews = packed['reviews']
+        else:
+            # Usually a reply cut off at max_tokens: keep the reviews that
+            # finished, and only the rest are reviewed one by one below
+            packed_reviews = _complete_packed_reviews(packed.get('raw_response', ''))
+        for review in packed_reviews:
+            if isinstance(review, dict) and review.get('file_path'):
+                reviews[review['file_path']] = _validate_review(review)
+    except Exception as e:
+        console.print(f"[yellow]⚠️  Packed review failed, reviewing files one by one: {e}[/yellow]")
+    
+    results = {}
+    for path, code in pack:
+        review = reviews.get(path)
+        if review is None:
+            # Missing or truncated in the packed reply
+            results[path] = analyze_code(code, path)
+        else:
+            _review_cache_put(review_cache_key(code), review)
+            results[path] = review
+    return results
+
+
+# Shared by every fan-out of Bedrock calls, so concurrent reviews in one
+# process stay within REVIEW_CONCURRENCY threads in total
+REVIEW_EXECUTOR = ThreadPoolExecutor(max_workers=REVIEW_CONCURRENCY, thread_name_prefix="review",
+                                     initializer=_mark_review_worker)
+
+
+def _split_cached_files(files: List[Tuple[str, str]]):
+    """
+    Split files into cached reviews, files to send, and duplicates of those.
+    
+    Args:
+        files: List of (path, code) tuples
+    
+    Returns:
+        Tuple of (cached results by path, list of (path, code) to review,
+        list of (path, path of the identical file being reviewed))
+    """
+    results = {}
+    pending = []
+    # Files with identical content are sent once: key -> first path sent
+    first_path_by_key = {}
+    duplicates = []
+    for path, code in files:
+        key = review_cache_key(code)
+        cached = _review_cache_get(key)
+        if cached is not None:
+            cached['file_path'] = path
+            results[path] = cached
+        elif key in first_path_by_key:
+            duplicates.append((path, first_path_by_key[key]))
+        else:
+            first_path_by_key[key] = path
+            pending.append((path, code))
+    return results, pending, duplicates
+
+
+async def analyze_code_batch_async(files: List[Tuple[str, str]],
+                                   max_concurrency: int = REVIEW_CONCURRENCY) -> Dict[str, Dict]:
+    """
+    Review several files, packing them into as few Bedrock calls as possible.
+    
+    Files that are already cached are not sent again. Packs are reviewed
+    concurrently on executor threads (boto3 clients are thread-safe), so
+    total time tracks the slowest pack rather than the sum. If a packed
+    reply cannot be matched back to its files, those files are reviewed
+    one by one.
+    
+    Args:
+        files: List of (path, code) tuples
+        max_concurrency: Maximum number of Bedrock calls in flight, capped
+            at REVIEW_CONCURRENCY (the size of the shared executor)
+    
+    Returns:
+        Mapping of file path to its review result, in the order of files
+    """
+    # Hashing and disk cache lookups block, so they run off the event loop
+    loop = asyncio.get_running_loop()
+    results, pending, duplicates = await loop.run_in_executor(None, _split_cached_files, files)
+    
+    # Packs run on REVIEW_EXECUTOR, so more than REVIEW_CONCURRENCY could
+    # never be in flight anyway; say so instead of silently ignoring it
+    if max_concurrency > REVIEW_CONCURRENCY:
+        console.print(f"[dim]Parallel requests capped at REVIEW_CONCURRENCY={REVIEW_CONCURRENCY}[/dim]")
+    semaphore = asyncio.Semaphore(max(1, min(max_concurrency, REVIEW_CONCURRENCY)))
+    
+    async def review(pack: List[Tuple[str, str]]) -> Dict[str, Dict]:
+        async with semaphore:
+            return await loop.run_in_executor(REVIEW_EXECUTOR, _analyze_pack, pack)
+    
+    for reviewed in await asyncio.gather(*(review(pack) for pack in pack_files(pending))):
+        results.update(reviewed)
+    
+    for path, first_path in duplicates:
+        results[path] = copy.deepcopy(results[first_path])
+        results[path]['file_path'] = path
+    
+    return {path: results[path] for path, _ in files}
 
-Code to review:
-{code_diff}
 
-Please provide your review in the following JSON format:
-{{
-    "summary": "Brief summary of the review",
-    "issues": [
-        {{
-            "type": "bug|style|documentation|performance|security",
-            "severity": "high|medium|low",
-            "line": <line_number>,
-            "message": "Description of the issue",
-            "suggestion": "Code suggestion in markdown format with ```suggestion blocks"
-        }}
-    ],
-    "missing_docstrings": [
-        {{
-            "function": "function_name",
-            "line": <line_number>,
-            "suggestion": "Suggested docstring"
-        }}
-    ],
-    "overall_score": <score_out_of_10>
-}}
+def analyze_code_batch(files: List[Tuple[str, str]]) -> Dict[str, Dict]:
+    """Synchronous wrapper for analyze_code_batch_async; not for use inside an event loop."""
+    return asyncio.run(analyze_code_batch_async(files))
 
-Focus on:
-1. Code style and formatting issues
-2. Missing function/method docstrings
-3. Potential bugs or logical errors
-4. Performance improvements
-5. Security concerns
-6. Best practices violations
 
-Return ONLY valid JSON, no additional text."""
+DIFF_SUFFIXES = ('.diff', '.patch')
 
-    try:
-        if bedrock is None:
-            return {
-                "error": "Bedrock client not initialized. Please check your AWS credentials.",
-                "suggestions": []
-            }
-        
-        # Use Claude 3 API format for Bedrock
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 4000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        }
-        
-        response = bedrock.invoke_model(
-            modelId=MODEL_ID,
-            body=json.dumps(body)
-        )
-        
-        response_body = json.loads(response['body'].read())
-        
-        # Extract the content from Claude's response
-        content = response_body.get('content', [])
-        if content:
-            text_content = content[0].get('text', '')
-            
-            # Try to parse JSON from the response
-            try:
-                # Extract JSON from markdown code blocks if present
-                if '```json' in text_content:
-                    json_start = text_content.find('```json') + 7
-                    json_end = text_content.find('```', json_start)
-                    text_content = text_content[json_start:json_end].strip()
-                elif '```' in text_content:
-                    json_start = text_content.find('```') + 3
-                    json_end = text_content.find('```', json_start)
-                    text_content = text_content[json_start:json_end].strip()
-                
-                result = json.loads(text_content)
-                result['file_path'] = file_path
-                return result
-            except json.JSONDecodeError:
-                # Fallback: return as text if JSON parsing fails
-                return {
-                    "summary": "Review completed",
-                    "raw_response": text_content,
-                    "issues": [],
-                    "missing_docstrings": [],
-                    "file_path": file_path,
-                    "overall_score": 5
-                }
-        else:
-            return {
-                "error": "No content in response",
-                "suggestions": []
-            }
-            
-    except Exception as e:
-        error_msg = str(e)
-        console.print(f"[bold red]Error calling Bedrock: {error_msg}[/bold red]")
-        
-        # Provide helpful error messages
-        if "UnrecognizedClientException" in error_msg or "invalid" in error_msg.lower():
-            error_msg += "\n\n💡 Troubleshooting tips:\n"
-            error_msg += "1. Check your AWS credentials in .env file\n"
-            error_msg += "2. Ensure credentials don't have quotes around them (e.g., use KEY=value not KEY='value')\n"
-            error_msg += "3. Verify credentials are valid and not expired\n"
-            error_msg += "4. Check that Bedrock is enabled in your AWS account\n"
-            error_msg += "5. Verify the AWS region is correct\n"
-        
-        return {
-            "error": error_msg,
-            "suggestions": []
-        }
 
+def is_diff_path(path: str) -> bool:
+    """Guess whether a path names a diff: a diff suffix, or 'diff' anywhere in it."""
+    return bool(path) and (path.endswith(DIFF_SUFFIXES) or 'diff' in path.lower())
 
-def analyze_file(file_path: str) -> Dict:
-    """Analyze a single file."""
+
+def analyze_file(file_path: str, errors: str = 'strict') -> Dict:
+    """Analyze a single file; errors handles invalid UTF-8 as for open()."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content, cached = _read_for_review(file_path, errors)
+        if cached is not None:
+            return cached
         
         console.print(f"[bold cyan]Analyzing: {file_path}[/bold cyan]")
         return analyze_code(content, file_path)
@@ -230,11 +1222,12 @@ def analyze_file(file_path: str) -> Dict:
         return {"error": str(e), "suggestions": []}
 
 
-def analyze_diff(diff_path: str) -> Dict:
-    """Analyze a diff file."""
+def analyze_diff(diff_path: str, errors: str = 'strict') -> Dict:
+    """Analyze a diff file; errors handles invalid UTF-8 as for open()."""
     try:
-        with open(diff_path, 'r', encoding='utf-8') as f:
-            diff_content = f.read()
+        diff_content, cached = _read_for_review(diff_path, errors)
+        if cached is not None:
+            return cached
         
         console.print(f"[bold cyan]Analyzing diff: {diff_path}[/bold cyan]")
         return analyze_code(diff_content, diff_path)
@@ -244,23 +1237,62 @@ def analyze_diff(diff_path: str) -> Dict:
         return {"error": str(e), "suggestions": []}
 
 
+def analyze_bytes(data: bytes, file_name: str,
+                  on_text: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Analyze in-memory file content, such as an upload, without touching disk.
+    
+    Args:
+        data: Raw file content
+        file_name: File name, used for context and to detect diffs
+        on_text: Optional streaming callback, see analyze_code
+    
+    Returns:
+        Dictionary containing suggestions and analysis
+    """
+    if file_name.endswith(DIFF_SUFFIXES):
+        console.print(f"[bold cyan]Analyzing diff: {file_name}[/bold cyan]")
+    else:
+        console.print(f"[bold cyan]Analyzing: {file_name}[/bold cyan]")
+    return analyze_code(data.decode('utf-8', errors='replace'), file_name, on_text)
+
+
+# Path separators (and the drive colon) can't appear in a result file name
+_RESULT_NAME_TABLE = str.maketrans('/\\:', '___')
+
+
+@lru_cache(maxsize=None)
+def _results_dir(output_dir: str) -> Path:
+    """Create the results directory once per process instead of on every save."""
+    path = Path(output_dir)
+    path.mkdir(exist_ok=True)
+    return path
+
+
 def save_results(results: Dict, output_dir: str = "results") -> str:
     """Save review results to JSON file."""
-    Path(output_dir).mkdir(exist_ok=True)
-    
     import datetime
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_name = results.get('file_path', 'unknown').replace('/', '_')
+    file_name = (results.get('file_path') or 'unknown').translate(_RESULT_NAME_TABLE)
     output_path = f"{output_dir}/review_{file_name}_{timestamp}.json"
+    data = orjson.dumps(results, option=orjson.OPT_INDENT_2)
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2)
+    _results_dir(output_dir)
+    try:
+        _write_file_atomic(output_path, data)
+    except FileNotFoundError:
+        # The directory was removed after it was first created
+        _results_dir.cache_clear()
+        _results_dir(output_dir)
+        _write_file_atomic(output_path, data)
     
     return output_path
 
 
 def display_results(results: Dict):
     """Display review results in a formatted way."""
+    from rich.panel import Panel
+    
     if "error" in results:
         console.print(f"[bold red]Error: {results['error']}[/bold red]")
         return
@@ -293,6 +1325,13 @@ def display_results(results: Dict):
     console.print(f"\n[bold]Overall Score: {score}/10[/bold]")
 
 
+_SUGGESTION_BLOCK_RE = re.compile(r'```suggestion\s*\n(.*?)```', re.DOTALL)
+_CODE_BLOCK_RE = re.compile(r'```(?:python|py|)\s*\n(.*?)```', re.DOTALL)
+
+# Lines on each side of the target line that a fix replaces
+FIX_CONTEXT_LINES = 3
+
+
 def extract_suggestion_code(suggestion_text: str) -> Optional[str]:
     """
     Extract code from GitHub suggestion format (```suggestion blocks).
@@ -303,23 +1342,21 @@ def extract_suggestion_code(suggestion_text: str) -> Optional[str]:
     Returns:
         Extracted code or None
     """
-    # Match ```suggestion blocks
-    pattern = r'```suggestion\s*\n(.*?)```'
-    matches = re.findall(pattern, suggestion_text, re.DOTALL)
-    if matches:
-        return matches[0].strip()
+    # Most issues carry prose only; the substring test avoids running both
+    # regexes over it (and tolerates a null suggestion)
+    if not suggestion_text or '```' not in suggestion_text:
+        return None
     
-    # Match regular code blocks if no suggestion blocks found
-    pattern = r'```(?:python|py|)\s*\n(.*?)```'
-    matches = re.findall(pattern, suggestion_text, re.DOTALL)
-    if matches:
-        return matches[0].strip()
+    # Match ```suggestion blocks, then regular code blocks
+    match = _SUGGESTION_BLOCK_RE.search(suggestion_text) or _CODE_BLOCK_RE.search(suggestion_text)
+    if match:
+        return match.group(1).strip()
     
     return None
 
 
 def apply_suggestion_to_file(file_path: str, line_number: int, suggestion_code: str, 
-                              context_lines: int = 3) -> Tuple[bool, str]:
+                              context_lines: int = FIX_CONTEXT_LINES) -> Tuple[bool, str]:
     """
     Apply a suggestion to a file at a specific line.
     
@@ -333,8 +1370,9 @@ def apply_suggestion_to_file(file_path: str, line_number: int, suggestion_code:
         Tuple of (success: bool, message: str)
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        # newline='' keeps the file's own line endings on read and write
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            lines = f.read().splitlines(keepends=True)
         
         if line_number < 1 or line_number > len(lines):
             return False, f"Line number {line_number} is out of range (file has {len(lines)} lines)"
@@ -346,24 +1384,30 @@ def apply_suggestion_to_file(file_path: str, line_number: int, suggestion_code:
         start_idx = max(0, idx - context_lines)
         end_idx = min(len(lines), idx + context_lines + 1)
         
-        # Split suggestion into lines
-        suggestion_lines = suggestion_code.split('\n')
-        if suggestion_lines and not suggestion_lines[-1].endswith('\n'):
-            suggestion_lines[-1] += '\n'
-        else:
-            suggestion_lines = [line + '\n' if not line.endswith('\n') else line 
-                              for line in suggestion_lines]
-        
-        # Create backup
-        backup_path = f"{file_path}.backup"
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
+        # Split suggestion into lines ending like the line being replaced
+        eol = '\r\n' if lines[idx].endswith('\r\n') else '\n'
+        suggestion_lines = [line + eol for line in suggestion_code.splitlines()]
         
-        # Apply the suggestion
-        new_lines = lines[:start_idx] + suggestion_lines + lines[end_idx:]
+        # Snapshot the original as a hard link (a copy across devices); the
+        # file is then replaced rather than rewritten, so the link keeps
+        # pointing at the old contents
+        backup_path = f"{file_path}.{time.time_ns()}.bak"
+        try:
+            os.link(file_path, backup_path)
+        except OSError:
+            shutil.copy2(file_path, backup_path)
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.writelines(new_lines)
+        # Apply the suggestion atomically
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+        try:
+            lines[start_idx:end_idx] = suggestion_lines
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(''.join(lines))
+            shutil.copymode(file_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
         
         return True, f"Applied suggestion to {file_path} (backup saved to {backup_path})"
     
@@ -392,6 +1436,61 @@ def apply_fix_to_file(file_path: str, issue: Dict) -> Tuple[bool, str]:
     return apply_suggestion_to_file(file_path, line_number, suggestion_code)
 
 
+def apply_all_fixes(issues: List[Dict], file_path: Optional[str] = None,
+                    max_workers: int = 8) -> List[Tuple[bool, str]]:
+    """
+    Apply the fixes from several issues, in parallel across files.
+    
+    Fixes to the same file run one at a time from the bottom of the file up,
+    so applying one fix does not shift the line numbers of the rest. Each fix
+    replaces the lines around its target, so a fix whose window overlaps one
+    already applied is skipped rather than allowed to overwrite it.
+    
+    Args:
+        issues: Issue dictionaries containing suggestions
+        file_path: File to apply every fix to; defaults to each issue's
+            own "file_path"
+        max_workers: Maximum number of files patched concurrently
+    
+    Returns:
+        List of (success: bool, message: str) tuples, in the order of issues
+    """
+    outcomes: List[Tuple[bool, str]] = [(False, "Not applied")] * len(issues)
+    
+    by_file: Dict[str, List[int]] = {}
+    for idx, issue in enumerate(issues):
+        target = file_path or issue.get('file_path')
+        if not target:
+            outcomes[idx] = (False, "No file path for issue")
+            continue
+        by_file.setdefault(target, []).append(idx)
+    
+    def line_of(idx: int) -> int:
+        line = issues[idx].get('line')
+        return line if isinstance(line, int) else 0
+    
+    def apply_to_file(target: str, indices: List[int]):
+        applied: List[Tuple[int, int]] = []
+        for idx in sorted(indices, key=line_of, reverse=True):
+            line = line_of(idx)
+            # Same window apply_suggestion_to_file replaces (1-indexed, inclusive)
+            start, end = line - FIX_CONTEXT_LINES, line + FIX_CONTEXT_LINES
+            if any(start <= hi and lo <= end for lo, hi in applied):
+                outcomes[idx] = (False, "Overlaps another fix")
+                continue
+            outcomes[idx] = apply_fix_to_file(target, issues[idx])
+            if outcomes[idx][0]:
+                applied.append((start, end))
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(apply_to_file, target, indices)
+                   for target, indices in by_file.items()]
+        for future in futures:
+            future.result()
+    
+    return outcomes
+
+
 def get_git_diff(repo_path: str, base_ref: Optional[str] = None, head_ref: Optional[str] = None) -> str:
     """
     Get git diff for a repository.
@@ -405,8 +1504,6 @@ def get_git_diff(repo_path: str, base_ref: Optional[str] = None, head_ref: Optio
         Git diff as string
     """
     try:
-        os.chdir(repo_path)
-        
         if base_ref and head_ref:
             cmd = ['git', 'diff', base_ref, head_ref]
         elif base_ref:
@@ -415,7 +1512,7 @@ def get_git_diff(repo_path: str, base_ref: Optional[str] = None, head_ref: Optio
             # Get unstaged changes
             cmd = ['git', 'diff']
         
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = subprocess.run(cmd, cwd=repo_path, capture_output=True, text=True, check=True)
         return result.stdout
     except subprocess.CalledProcessError as e:
         return f"Error getting git diff: {e.stderr}"
@@ -472,47 +1569,91 @@ def analyze_git_repo(repo_path: str, base_ref: Optional[str] = None, head_ref: O
     return results
 
 
+DEFAULT_CODE_EXTENSIONS = ('.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.cpp', '.c', '.go', '.rs', '.php', '.rb')
+
+# Directory names that are never descended into, matched by exact name
+# (so build.py or distance.py are still reviewed); REVIEW_IGNORE_DIRS adds
+# a comma-separated list of extra names
+IGNORED_DIRS = frozenset({'.git', 'node_modules', '__pycache__', '.venv', 'venv', 'dist', 'build', '.next'}
+                         | {name.strip() for name in os.getenv("REVIEW_IGNORE_DIRS", "").split(',') if name.strip()})
+
+
+def _scan_level(path: str, extensions: Tuple[str, ...],
+                subdirs: List[str], found: List[str]):
+    """List one directory, collecting matching files and subdirectories to descend into."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in IGNORED_DIRS:
+                    subdirs.append(entry.path)
+            elif entry.name.endswith(extensions):
+                found.append(entry.path)
+
+
+def _scan_code_files(root: str, extensions: Tuple[str, ...]) -> List[str]:
+    """Walk a directory tree with os.scandir and collect files with matching extensions."""
+    found = []
+    pending = [root]
+    while pending:
+        try:
+            _scan_level(pending.pop(), extensions, pending, found)
+        except OSError:
+            continue
+    return found
+
+
 def get_code_files(directory: str, extensions: Optional[List[str]] = None) -> List[str]:
     """
     Get all code files in a directory.
     
+    Ignored directories (IGNORED_DIRS) are pruned without being listed, and
+    top-level subdirectories are walked in parallel threads.
+    
     Args:
         directory: Directory path to scan
-        extensions: List of file extensions to include (default: common code extensions)
+        extensions: List of file extensions to include, with or without the
+            leading dot (default: common code extensions)
     
     Returns:
         List of file paths
     """
-    if extensions is None:
-        extensions = ['.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.cpp', '.c', '.go', '.rs', '.php', '.rb']
+    if extensions:
+        extensions = tuple({ext if ext.startswith('.') else f".{ext}"
+                            for ext in (e.strip() for e in extensions) if ext})
+    extensions = extensions or DEFAULT_CODE_EXTENSIONS
     
     code_files = []
-    directory_path = Path(directory)
-    
-    if not directory_path.exists():
+    subdirs = []
+    try:
+        _scan_level(str(Path(directory)), extensions, subdirs, code_files)
+    except OSError:
         return code_files
     
-    for ext in extensions:
-        pattern = f"**/*{ext}"
-        code_files.extend(directory_path.glob(pattern))
-    
-    # Filter out common directories to ignore
-    ignore_dirs = {'.git', 'node_modules', '__pycache__', '.venv', 'venv', 'dist', 'build', '.next'}
-    filtered_files = [
-        str(f) for f in code_files 
-        if not any(ignore_dir in str(f) for ignore_dir in ignore_dirs)
-    ]
+    if subdirs:
+        with ThreadPoolExecutor(max_workers=min(8, len(subdirs))) as executor:
+            for found in executor.map(lambda subdir: _scan_code_files(subdir, extensions), subdirs):
+                code_files.extend(found)
     
-    return sorted(filtered_files)
+    return sorted(code_files)
 
 
-def analyze_directory(directory: str, max_files: int = 50) -> Dict:
+def analyze_directory(directory: str, max_files: int = 50,
+                      max_parallel_requests: Optional[int] = None,
+                      wait_for_batch: bool = True) -> Dict:
     """
     Analyze all code files in a directory.
     
+    Files are reviewed as in analyze_multiple_files: small files are packed
+    several to a Bedrock call, and with batch inference configured (see
+    batch_enabled) large runs go to one batch job.
+    
     Args:
         directory: Directory path to analyze
         max_files: Maximum number of files to analyze (default: 50)
+        max_parallel_requests: Maximum Bedrock calls in flight (default and
+            upper limit: REVIEW_CONCURRENCY)
+        wait_for_batch: Block until a batch job finishes (see
+            analyze_multiple_files_async)
     
     Returns:
         Dictionary containing aggregated review results
@@ -536,106 +1677,164 @@ def analyze_directory(directory: str, max_files: int = 50) -> Dict:
         code_files = code_files[:max_files]
         console.print(f"[yellow]⚠️  Limiting analysis to first {max_files} files[/yellow]")
     
-    all_issues = []
-    all_missing_docs = []
-    file_results = []
-    total_score = 0
-    analyzed_count = 0
+    results = analyze_multiple_files(code_files, max_parallel_requests or REVIEW_CONCURRENCY, wait_for_batch)
+    if "error" in results:
+        return results
+    results['summary'] = results['summary'].replace(" files.", f" files in {directory}.", 1)
+    results['file_path'] = directory
+    results['total_files'] = len(code_files)
+    return results
+
+
+def _read_files_for_review(file_paths: List[str]) -> Tuple[Dict[str, Dict], List[Tuple[str, str]]]:
+    """
+    Read files for a multi-file review, splitting cached reviews from new work.
+    
+    Args:
+        file_paths: List of file paths to analyze
     
-    for file_path in code_files:
+    Returns:
+        Tuple of (cached results by path, list of (path, content) to review)
+    """
+    results_by_file = {}
+    files = []
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            console.print(f"[yellow]⚠️  File not found: {file_path}[/yellow]")
+            continue
+        
         try:
-            console.print(f"[cyan]Analyzing: {file_path}[/cyan]")
-            result = analyze_file(file_path)
-            
-            if "error" not in result:
-                # Add file path to each issue
-                for issue in result.get('issues', []):
-                    issue['file_path'] = file_path
-                    all_issues.append(issue)
-                
-                for doc in result.get('missing_docstrings', []):
-                    doc['file_path'] = file_path
-                    all_missing_docs.append(doc)
-                
-                file_results.append({
-                    "file_path": file_path,
-                    "score": result.get('overall_score', 0),
-                    "issue_count": len(result.get('issues', [])),
-                    "missing_docs_count": len(result.get('missing_docstrings', []))
-                })
-                
-                total_score += result.get('overall_score', 0)
-                analyzed_count += 1
+            content, cached = _read_for_review(file_path)
         except Exception as e:
             console.print(f"[red]Error analyzing {file_path}: {e}[/red]")
             continue
+        
+        if cached is not None:
+            results_by_file[file_path] = cached
+        else:
+            console.print(f"[cyan]Analyzing: {file_path}[/cyan]")
+            files.append((file_path, content))
+    return results_by_file, files
+
+
+async def analyze_multiple_files_async(file_paths: List[str],
+                                      max_parallel_requests: int = REVIEW_CONCURRENCY,
+                                      wait_for_batch: bool = True) -> Dict:
+    """
+    Analyze multiple files concurrently and return aggregated results.
     
-    avg_score = total_score / analyzed_count if analyzed_count > 0 else 0
+    Uncached files go to a batch job when batch_enabled allows it.
     
-    return {
-        "summary": f"Analyzed {analyzed_count} files in {directory}. Found {len(all_issues)} total issues and {len(all_missing_docs)} missing docstrings.",
-        "issues": all_issues,
-        "missing_docstrings": all_missing_docs,
-        "overall_score": round(avg_score, 1),
-        "file_path": directory,
-        "files_analyzed": analyzed_count,
-        "total_files": len(code_files),
-        "file_results": file_results
-    }
+    Args:
+        file_paths: List of file paths to analyze
+        max_parallel_requests: Maximum Bedrock calls in flight, capped at
+            REVIEW_CONCURRENCY
+        wait_for_batch: Block until a batch job finishes; if False, return
+            the cached results at once with "in_progress" set and the
+            submitted job under "batch_job", for get_batch_review
+    
+    Returns:
+        Dictionary containing aggregated review results
+    """
+    if not file_paths:
+        return {"error": "No files provided"}
+    
+    # Stats, reads and hashing block, so they run off the event loop
+    loop = asyncio.get_running_loop()
+    results_by_file, files = await loop.run_in_executor(None, _read_files_for_review, file_paths)
+    
+    def aggregate(**extra) -> Dict:
+        # Keep the caller's file order
+        ordered = {path: results_by_file[path] for path in file_paths if path in results_by_file}
+        return {**aggregate_file_results(ordered), **extra}
+    
+    if batch_enabled(len(files)) and not wait_for_batch:
+        job = await loop.run_in_executor(None, submit_batch_review, dict(files))
+        if "error" in job:
+            console.print(f"[yellow]⚠️  Batch submission failed, reviewing files directly: {job['error']}[/yellow]")
+        else:
+            console.print(f"[cyan]Submitted batch job: {job['job_arn']}[/cyan]")
+            return aggregate(in_progress=True, batch_job=job)
+    elif batch_enabled(len(files)):
+        # The job blocks while polling, so keep it off the review executor
+        batch = await loop.run_in_executor(None, _run_batch_review, dict(files))
+        if batch.get('in_progress'):
+            # Reviewing directly now would pay for the same files twice
+            return aggregate(**batch)
+        if "error" in batch:
+            console.print(f"[yellow]⚠️  Batch review failed, reviewing files directly: {batch['error']}[/yellow]")
+        else:
+            results_by_file.update(batch['results_by_file'])
+            files = [(path, code) for path, code in files if path not in results_by_file]
+    
+    results_by_file.update(await analyze_code_batch_async(files, max_parallel_requests))
+    return aggregate()
 
 
-def analyze_multiple_files(file_paths: List[str]) -> Dict:
+def analyze_multiple_files(file_paths: List[str],
+                           max_parallel_requests: int = REVIEW_CONCURRENCY,
+                           wait_for_batch: bool = True) -> Dict:
     """
     Analyze multiple files and return aggregated results.
     
+    Synchronous wrapper for analyze_multiple_files_async; from async code
+    (e.g. FastAPI handlers) await that instead.
+    
     Args:
         file_paths: List of file paths to analyze
+        max_parallel_requests: Maximum Bedrock calls in flight, capped at
+            REVIEW_CONCURRENCY
+        wait_for_batch: Block until a batch job finishes (see
+            analyze_multiple_files_async)
     
     Returns:
         Dictionary containing aggregated review results
     """
-    if not file_paths:
-        return {"error": "No files provided"}
+    return asyncio.run(analyze_multiple_files_async(file_paths, max_parallel_requests, wait_for_batch))
+
+
+def aggregate_file_results(results_by_file: Dict[str, Dict]) -> Dict:
+    """
+    Merge per-file review results into a single multi-file result.
+    
+    Args:
+        results_by_file: Mapping of file path to its review result
     
+    Returns:
+        Dictionary containing aggregated review results
+    """
     all_issues = []
     all_missing_docs = []
     file_results = []
-    total_score = 0
-    analyzed_count = 0
+    scores = []
     
-    for file_path in file_paths:
-        if not os.path.exists(file_path):
-            console.print(f"[yellow]⚠️  File not found: {file_path}[/yellow]")
+    for file_path, result in results_by_file.items():
+        if "error" in result:
+            console.print(f"[red]Error analyzing {file_path}: {result['error']}[/red]")
             continue
         
-        try:
-            console.print(f"[cyan]Analyzing: {file_path}[/cyan]")
-            result = analyze_file(file_path)
-            
-            if "error" not in result:
-                # Add file path to each issue
-                for issue in result.get('issues', []):
-                    issue['file_path'] = file_path
-                    all_issues.append(issue)
-                
-                for doc in result.get('missing_docstrings', []):
-                    doc['file_path'] = file_path
-                    all_missing_docs.append(doc)
-                
-                file_results.append({
-                    "file_path": file_path,
-                    "score": result.get('overall_score', 0),
-                    "issue_count": len(result.get('issues', [])),
-                    "missing_docs_count": len(result.get('missing_docstrings', []))
-                })
-                
-                total_score += result.get('overall_score', 0)
-                analyzed_count += 1
-        except Exception as e:
-            console.print(f"[red]Error analyzing {file_path}: {e}[/red]")
-            continue
+        # Tag each entry with its file in place (results are per-call copies)
+        # and move whole lists across with extend
+        issues = result.get('issues') or []
+        missing_docs = result.get('missing_docstrings') or []
+        for entry in chain(issues, missing_docs):
+            entry['file_path'] = file_path
+        all_issues.extend(issues)
+        all_missing_docs.extend(missing_docs)
+        
+        score = result.get('overall_score', 0)
+        file_results.append({
+            "file_path": file_path,
+            "score": score,
+            "issue_count": len(issues),
+            "missing_docs_count": len(missing_docs)
+        })
+        
+        # The model occasionally returns a non-numeric score
+        scores.append(score if isinstance(score, (int, float)) else 0)
     
-    avg_score = total_score / analyzed_count if analyzed_count > 0 else 0
+    analyzed_count = len(scores)
+    avg_score = fmean(scores) if scores else 0
     
     return {
         "summary": f"Analyzed {analyzed_count} files. Found {len(all_issues)} total issues and {len(all_missing_docs)} missing docstrings.",
@@ -648,6 +1847,236 @@ def analyze_multiple_files(file_paths: List[str]) -> Dict:
     }
 
 
+BATCH_TERMINAL_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+
+def batch_enabled(file_count: int) -> bool:
+    """Check whether a review of file_count files should use batch inference."""
+    return bool(BATCH_S3_URI and BATCH_ROLE_ARN) and file_count >= BATCH_MIN_RECORDS
+
+
+def _split_s3_uri(uri: str) -> Tuple[str, str]:
+    """Split an s3://bucket/key URI into (bucket, key)."""
+    bucket, _, key = uri[len("s3://"):].partition('/')
+    return bucket, key
+
+
+def submit_batch_review(contents: Dict[str, str]) -> Dict:
+    """
+    Submit a Bedrock batch inference job reviewing several files.
+    
+    Writes one JSONL record per file under BEDROCK_BATCH_S3_URI and starts a
+    model invocation job running as BEDROCK_BATCH_ROLE_ARN. Bedrock rejects
+    jobs below its minimum record count, see batch_enabled().
+    
+    Args:
+        contents: Mapping of file path to the code to review
+    
+    Returns:
+        Dictionary describing the job, to be passed to get_batch_review
+    """
+    if not BATCH_S3_URI or not BATCH_ROLE_ARN:
+        return {"error": "Batch inference requires BEDROCK_BATCH_S3_URI and BEDROCK_BATCH_ROLE_ARN"}
+    
+    bedrock = get_aws_client("bedrock")
+    s3 = get_aws_client("s3")
+    if bedrock is None or s3 is None:
+        return {"error": "Bedrock client not initialized"}
+    
+    import datetime
+    job_name = f"code-review-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    job_uri = f"{BATCH_S3_URI.rstrip('/')}/{job_name}"
+    input_uri = f"{job_uri}/input.jsonl"
+    output_uri = f"{job_uri}/output/"
+    
+    record_files = {}
+    record_keys = {}
+    lines = []
+    for idx, (file_path, code) in enumerate(contents.items()):
+        record_id = f"REC{idx:08d}"
+        record_files[record_id] = file_path
+        record_keys[record_id] = review_cache_key(code)
+        lines.append(orjson.dumps({"recordId": record_id, "modelInput": build_request_body(code)}))
+    
+    try:
+        bucket, key = _split_s3_uri(input_uri)
+        s3.put_object(Bucket=bucket, Key=key, Body=b"\n".join(lines))
+        
+        response = bedrock.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=BATCH_ROLE_ARN,
+            modelId=MODEL_ID,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}}
+        )
+    except Exception as e:
+        console.print(f"[bold red]Error submitting batch job: {e}[/bold red]")
+        return {"error": format_bedrock_error(e)}
+    
+    return {
+        "job_arn": response['jobArn'],
+        "output_uri": output_uri,
+        "record_files": record_files,
+        "record_keys": record_keys
+    }
+
+
+def get_batch_review(job: Dict) -> Dict:
+    """
+    Check a batch review job once and collect its results when finished.
+    
+    Successful reviews from a finished job are added to the review cache.
+    
+    Args:
+        job: Job description returned by submit_batch_review
+    
+    Returns:
+        Dictionary with the job "status", plus once the job has completed
+        aggregated review results under "results" and the per-file results
+        under "results_by_file"
+    """
+    bedrock = get_aws_client("bedrock")
+    s3 = get_aws_client("s3")
+    if bedrock is None or s3 is None:
+        return {"error": "Bedrock client not initialized"}
+    
+    try:
+        job_info = bedrock.get_model_invocation_job(jobIdentifier=job['job_arn'])
+        status = job_info['status']
+        if status not in BATCH_TERMINAL_STATUSES:
+            return {"status": status}
+        if status not in ("Completed", "PartiallyCompleted"):
+            return {
+                "status": status,
+                "error": f"Batch job ended with status {status}: {job_info.get('message', 'no details')}"
+            }
+        
+        # Bedrock writes <output_uri>/<job id>/<input file name>.out
+        job_id = job['job_arn'].rsplit('/', 1)[-1]
+        bucket, key = _split_s3_uri(f"{job['output_uri']}{job_id}/input.jsonl.out")
+        body = s3.get_object(Bucket=bucket, Key=key)['Body']
+        
+        results_by_file = {}
+        for line in body.iter_lines():
+            if not line:
+                continue
+            record = orjson.loads(line)
+            record_id = record.get('recordId')
+            file_path = job['record_files'].get(record_id, record_id)
+            if 'modelOutput' in record:
+                results_by_file[file_path] = parse_review_response(record['modelOutput'], file_path)
+                if record_id in job.get('record_keys', {}):
+                    _review_cache_put(job['record_keys'][record_id], results_by_file[file_path])
+            else:
+                error = record.get('error', {})
+                results_by_file[file_path] = {
+                    "error": error.get('errorMessage', 'No output for record'),
+                    "suggestions": []
+                }
+    except Exception as e:
+        console.print(f"[bold red]Error reading batch job: {e}[/bold red]")
+        return {"error": format_bedrock_error(e)}
+    
+    results = aggregate_file_results(results_by_file)
+    results['batch_job'] = job['job_arn']
+    return {"status": status, "results": results, "results_by_file": results_by_file}
+
+
+def _run_batch_review(contents: Dict[str, str], poll_interval: float = 30,
+                      max_poll_interval: float = 300,
+                      timeout: float = BATCH_TIMEOUT) -> Dict:
+    """
+    Submit a batch review job and block until it finishes.
+    
+    Failed status checks are retried up to BATCH_POLL_RETRIES times in a row. If the job is still
+    running when the checks give up or timeout passes, the result carries
+    "in_progress" and the submitted job under "batch_job", so the caller can
+    collect it later with get_batch_review instead of paying for the files
+    again.
+    
+    Args:
+        contents: Mapping of file path to the code to review
+        poll_interval: Initial delay between status checks in seconds
+        max_poll_interval: Upper bound on the delay between status checks
+        timeout: Seconds to wait for the job before giving up
+    
+    Returns:
+        The finished job from get_batch_review, or a dict with an "error" key
+    """
+    job = submit_batch_review(contents)
+    if "error" in job:
+        return job
+    
+    console.print(f"[cyan]Submitted batch job: {job['job_arn']}[/cyan]")
+    deadline = time.monotonic() + timeout
+    failed_checks = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {
+                "error": f"Batch job {job['job_arn']} still running after {timeout:.0f}s",
+                "in_progress": True,
+                "batch_job": job
+            }
+        time.sleep(min(poll_interval, remaining))
+        
+        batch = get_batch_review(job)
+        if "results" in batch:
+            break
+        if "error" in batch:
+            # Only a terminal status means the job is over; anything else is
+            # a failed check on a job that may still be running
+            if batch.get('status') in BATCH_TERMINAL_STATUSES:
+                return {"error": batch['error']}
+            failed_checks += 1
+            if failed_checks > BATCH_POLL_RETRIES:
+                return {
+                    "error": f"Could not check batch job {job['job_arn']}: {batch['error']}",
+                    "in_progress": True,
+                    "batch_job": job
+                }
+            console.print(f"[yellow]⚠️  Batch status check failed ({failed_checks}/{BATCH_POLL_RETRIES}), retrying[/yellow]")
+            continue
+        
+        failed_checks = 0
+        console.print(f"[dim]Batch job status: {batch['status']}[/dim]")
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+    
+    return batch
+
+
+def analyze_files_batch(file_paths: List[str], poll_interval: float = 30,
+                        max_poll_interval: float = 300) -> Dict:
+    """
+    Review many files with a single Bedrock batch inference job.
+    
+    Blocks until the job finishes, polling with exponential backoff.
+    
+    Args:
+        file_paths: List of file paths to analyze
+        poll_interval: Initial delay between status checks in seconds
+        max_poll_interval: Upper bound on the delay between status checks
+    
+    Returns:
+        Dictionary containing aggregated review results
+    """
+    if not file_paths:
+        return {"error": "No files provided"}
+    
+    contents = {}
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                contents[file_path] = f.read()
+        except Exception as e:
+            console.print(f"[yellow]⚠️  Skipping {file_path}: {e}[/yellow]")
+    
+    batch = _run_batch_review(contents, poll_interval, max_poll_interval)
+    if "error" in batch:
+        return batch
+    return batch['results']
+
+
 if __name__ == "__main__":
     console.print("[bold cyan]🔍 AWS Bedrock Code Review Agent[/bold cyan]\n")
     
@@ -658,7 +2087,7 @@ if __name__ == "__main__":
         exit(1)
     
     # Determine if it's a diff or regular file
-    if file_path.endswith('.diff') or file_path.endswith('.patch') or 'diff' in file_path.lower():
+    if is_diff_path(file_path):
         results = analyze_diff(file_path)
     else:
         results = analyze_file(file_path)
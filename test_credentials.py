@@ -3,26 +3,68 @@
 Diagnostic script to test AWS credentials and Bedrock access
 """
 import os
+import re
+import sys
+import atexit
 import json
+import threading
 import boto3
+from concurrent.futures import Future
+from functools import lru_cache
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Load .env file
 env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path, override=True)
-load_dotenv(override=False)
+
+
+@lru_cache(maxsize=None)
+def load_env():
+    """Load the project .env once, falling back to the default search when it is missing."""
+    if env_path.exists():
+        load_dotenv(dotenv_path=env_path, override=True)
+    else:
+        load_dotenv()
+
+
+load_env()
+
+
+# Output is queued and written in one call per section instead of a
+# write (and, on a terminal, a flush) per line
+_output = []
+
+
+def emit(line=""):
+    """Queue a line of output for the next flush_output()."""
+    _output.append(line)
+
+
+def flush_output():
+    """Write all queued output at once."""
+    if _output:
+        sys.stdout.write("\n".join(_output) + "\n")
+        sys.stdout.flush()
+        _output.clear()
+
+
+# Covers every exit path, including the early exit(1) calls
+atexit.register(flush_output)
+
+
+# Leading/trailing whitespace and quotes, stripped in a single pass
+_CREDENTIAL_TRIM_RE = re.compile(r'^[\s\'"]+|[\s\'"]+$')
+
 
 def sanitize_credential(value):
     """Remove quotes and whitespace from credentials."""
     if not value:
         return None
-    return value.strip().strip('"').strip("'").strip()
+    return _CREDENTIAL_TRIM_RE.sub('', value) or None
 
-print("=" * 60)
-print("AWS Credentials Diagnostic Tool")
-print("=" * 60)
-print()
+emit("=" * 60)
+emit("AWS Credentials Diagnostic Tool")
+emit("=" * 60)
+emit()
 
 # Check environment variables
 aws_region = sanitize_credential(os.getenv("AWS_REGION")) or sanitize_credential(os.getenv("AWS_DEFAULT_REGION")) or "us-east-1"
@@ -32,169 +74,218 @@ aws_secret_raw = os.getenv("AWS_SECRET_ACCESS_KEY") or os.getenv("AWS_SECRET_KEY
 aws_key = sanitize_credential(aws_key_raw)
 aws_secret = sanitize_credential(aws_secret_raw)
 
-print(f"📁 .env file path: {env_path}")
-print(f"✅ .env file exists: {env_path.exists()}")
-print()
-
-print("🔑 Credentials Check:")
-print(f"   AWS_REGION: {aws_region}")
-print(f"   AWS_ACCESS_KEY_ID: {'✅ Set' if aws_key else '❌ Not set'}")
-if aws_key:
-    print(f"      Length: {len(aws_key)} characters")
-    print(f"      Preview: {aws_key[:10]}...{aws_key[-4:] if len(aws_key) > 14 else ''}")
-    # Check for common issues
-    if aws_key.startswith('"') or aws_key.startswith("'"):
-        print(f"      ⚠️  WARNING: Key starts with quotes!")
-    if aws_key.endswith('"') or aws_key.endswith("'"):
-        print(f"      ⚠️  WARNING: Key ends with quotes!")
-    if ' ' in aws_key:
-        print(f"      ⚠️  WARNING: Key contains spaces!")
-    if not aws_key.startswith('AKIA') and len(aws_key) == 20:
-        print(f"      ⚠️  WARNING: Key doesn't start with 'AKIA' (unusual format)")
-else:
-    print(f"      Raw value: {aws_key_raw}")
-
-print(f"   AWS_SECRET_ACCESS_KEY: {'✅ Set' if aws_secret else '❌ Not set'}")
-if aws_secret:
-    print(f"      Length: {len(aws_secret)} characters")
-    print(f"      Preview: {aws_secret[:4]}...{aws_secret[-4:] if len(aws_secret) > 8 else ''}")
-    # Check for common issues
-    if aws_secret.startswith('"') or aws_secret.startswith("'"):
-        print(f"      ⚠️  WARNING: Secret starts with quotes!")
-    if aws_secret.endswith('"') or aws_secret.endswith("'"):
-        print(f"      ⚠️  WARNING: Secret ends with quotes!")
-    if ' ' in aws_secret:
-        print(f"      ⚠️  WARNING: Secret contains spaces!")
-else:
-    print(f"      Raw value: {aws_secret_raw}")
+emit(f"📁 .env file path: {env_path}")
+emit(f"✅ .env file exists: {env_path.exists()}")
+emit()
+
+# (check, warning) pairs run against every credential that is set
+CREDENTIAL_CHECKS = (
+    (lambda v: v.startswith(('"', "'")), "starts with quotes!"),
+    (lambda v: v.endswith(('"', "'")), "ends with quotes!"),
+    (lambda v: ' ' in v, "contains spaces!"),
+)
+ACCESS_KEY_CHECKS = CREDENTIAL_CHECKS + (
+    (lambda v: not v.startswith('AKIA') and len(v) == 20, "doesn't start with 'AKIA' (unusual format)"),
+)
+
+
+def print_preview(value, head, tail):
+    """Print a credential's length and a preview of its first and last characters."""
+    emit(f"      Length: {len(value)} characters")
+    emit(f"      Preview: {value[:head]}...{value[-tail:] if len(value) > head + tail else ''}")
+
+
+def report_credential(name, label, value, raw_value, preview, checks=CREDENTIAL_CHECKS):
+    """Print whether a credential is set, a preview, and warnings for common mistakes."""
+    emit(f"   {name}: {'✅ Set' if value else '❌ Not set'}")
+    if not value:
+        emit(f"      Raw value: {raw_value}")
+        return
+    print_preview(value, *preview)
+    for check, warning in checks:
+        if check(value):
+            emit(f"      ⚠️  WARNING: {label} {warning}")
+
+
+emit("🔑 Credentials Check:")
+emit(f"   AWS_REGION: {aws_region}")
+for name, label, value, raw_value, preview, checks in (
+    ("AWS_ACCESS_KEY_ID", "Key", aws_key, aws_key_raw, (10, 4), ACCESS_KEY_CHECKS),
+    ("AWS_SECRET_ACCESS_KEY", "Secret", aws_secret, aws_secret_raw, (4, 4), CREDENTIAL_CHECKS),
+):
+    report_credential(name, label, value, raw_value, preview, checks)
 
 # Check for session token
 aws_session_token_raw = os.getenv("AWS_SESSION_TOKEN") or os.getenv("AWS_SECURITY_TOKEN")
 aws_session_token = sanitize_credential(aws_session_token_raw)
 
 is_temporary = aws_key and aws_key.startswith("ASIA")
-print(f"   AWS_SESSION_TOKEN: {'✅ Set' if aws_session_token else '❌ Not set'}")
+emit(f"   AWS_SESSION_TOKEN: {'✅ Set' if aws_session_token else '❌ Not set'}")
 if is_temporary:
     if aws_session_token:
-        print(f"      Length: {len(aws_session_token)} characters")
-        print(f"      Preview: {aws_session_token[:20]}...{aws_session_token[-10:] if len(aws_session_token) > 30 else ''}")
+        print_preview(aws_session_token, 20, 10)
     else:
-        print(f"      🔴 CRITICAL: Temporary credentials (ASIA) require AWS_SESSION_TOKEN!")
-        print(f"      Add AWS_SESSION_TOKEN=... to your .env file")
+        emit(f"      🔴 CRITICAL: Temporary credentials (ASIA) require AWS_SESSION_TOKEN!")
+        emit(f"      Add AWS_SESSION_TOKEN=... to your .env file")
 elif aws_session_token:
-    print(f"      ℹ️  Session token present but not needed for permanent credentials")
+    emit(f"      ℹ️  Session token present but not needed for permanent credentials")
+
+emit()
+
+# Session arguments, built once from the sanitized values; without explicit
+# keys boto3 falls back to the default credential chain
+CREDS = {'region_name': aws_region}
+if aws_key and aws_secret:
+    CREDS['aws_access_key_id'] = aws_key
+    CREDS['aws_secret_access_key'] = aws_secret
+    if aws_session_token:
+        CREDS['aws_session_token'] = aws_session_token
+
+
+@lru_cache(maxsize=None)
+def build_session():
+    """Create one boto3 session shared by every client the checks below use."""
+    return boto3.Session(**CREDS)
+
+
+@lru_cache(maxsize=None)
+def get_client(service):
+    """Create one client per service from the shared session."""
+    return build_session().client(service)
+
+
+def get_caller_identity():
+    """Ask STS who the credentials belong to, raising if they are rejected."""
+    return get_client('sts').get_caller_identity()
+
+
+# Just check if we can list models (this requires bedrock:ListFoundationModels permission)
+# Instead, we'll try to invoke a simple model call
+model_id = os.getenv("MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+
+
+# Minimal payload for the test invocation; it never varies, so it is
+# encoded to bytes once here rather than on each call
+TEST_BODY = json.dumps({
+    "anthropic_version": "bedrock-2023-05-31",
+    "max_tokens": 10,
+    "messages": [{"role": "user", "content": "Hi"}]
+}).encode()
+
+
+def probe_bedrock():
+    """Invoke the model with a minimal payload, raising if Bedrock rejects the call."""
+    get_client('bedrock-runtime').invoke_model(
+        modelId=model_id,
+        body=TEST_BODY
+    )
+
+
+def start_probe(probe):
+    """
+    Run a probe on a daemon thread and return a Future for its result.
+    
+    Unlike an executor thread, a daemon thread doesn't hold up interpreter
+    exit, so a failed identity check can exit without waiting on Bedrock.
+    """
+    future = Future()
+    
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(probe())
+        except Exception as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, daemon=True).start()
+    return future
 
-print()
 
 # Test AWS STS (Identity validation)
-print("🧪 Testing AWS Credentials:")
+emit("🧪 Testing AWS Credentials:")
+if aws_key and aws_secret:
+    if is_temporary and not aws_session_token:
+        emit("   ❌ ERROR: Cannot test - temporary credentials require AWS_SESSION_TOKEN")
+        emit()
+        emit("   📋 Fix your .env file:")
+        emit("      Add this line:")
+        emit("      AWS_SESSION_TOKEN=your_session_token_here")
+        emit()
+        exit(1)
+else:
+    emit("   ⚠️  Using default AWS credential chain...")
+
+# Show everything so far before blocking on the network
+flush_output()
+bedrock_probe = None
 try:
-    if aws_key and aws_secret:
-        client_params = {
-            'service_name': 'sts',
-            'region_name': aws_region,
-            'aws_access_key_id': aws_key,
-            'aws_secret_access_key': aws_secret
-        }
-        if aws_session_token:
-            client_params['aws_session_token'] = aws_session_token
-        elif is_temporary:
-            print("   ❌ ERROR: Cannot test - temporary credentials require AWS_SESSION_TOKEN")
-            print()
-            print("   📋 Fix your .env file:")
-            print("      Add this line:")
-            print("      AWS_SESSION_TOKEN=your_session_token_here")
-            print()
-            exit(1)
-        sts_client = boto3.client(**client_params)
-    else:
-        print("   ⚠️  Using default AWS credential chain...")
-        sts_client = boto3.client('sts', region_name=aws_region)
+    # Clients are created here first because a boto3 session isn't
+    # thread-safe; setup errors (unknown profile, bad region) land in the
+    # except below like any other credential problem
+    get_client('sts')
+    get_client('bedrock-runtime')
     
-    identity = sts_client.get_caller_identity()
-    print(f"   ✅ Credentials are VALID!")
-    print(f"   Account ID: {identity.get('Account', 'N/A')}")
-    print(f"   User ARN: {identity.get('Arn', 'N/A')}")
-    print(f"   User ID: {identity.get('UserId', 'N/A')}")
+    # The STS and Bedrock probes are independent round-trips, so start both
+    # now and let them overlap; results are still reported in order below
+    identity_probe = start_probe(get_caller_identity)
+    bedrock_probe = start_probe(probe_bedrock)
+    identity = identity_probe.result()
+    emit(f"   ✅ Credentials are VALID!")
+    emit(f"   Account ID: {identity.get('Account', 'N/A')}")
+    emit(f"   User ARN: {identity.get('Arn', 'N/A')}")
+    emit(f"   User ID: {identity.get('UserId', 'N/A')}")
+    sts_ok = True
 except Exception as e:
-    print(f"   ❌ Credentials are INVALID: {e}")
-    print()
-    print("   💡 This means your credentials are wrong or expired.")
-    print("   💡 Get new credentials from: https://console.aws.amazon.com/iam/")
-    print()
-    exit(1)
+    emit(f"   ❌ Credentials are INVALID: {e}")
+    emit()
+    emit("   💡 This means your credentials are wrong or expired.")
+    emit("   💡 Get new credentials from: https://console.aws.amazon.com/iam/")
+    emit()
+    sts_ok = False
+
+# A Bedrock result is meaningless with invalid credentials, so don't wait for it
+if not sts_ok:
+    if bedrock_probe is not None:
+        bedrock_probe.cancel()
+    sys.exit(1)
 
-print()
+emit()
 
 # Test Bedrock access
-print("🧪 Testing Bedrock Access:")
+emit("🧪 Testing Bedrock Access:")
+emit(f"   Testing with model: {model_id}")
+flush_output()
 try:
-    if aws_key and aws_secret:
-        bedrock = boto3.client(
-            'bedrock-runtime',
-            region_name=aws_region,
-            aws_access_key_id=aws_key,
-            aws_secret_access_key=aws_secret
-        )
-    else:
-        bedrock = boto3.client('bedrock-runtime', region_name=aws_region)
-    
-    # Just check if we can list models (this requires bedrock:ListFoundationModels permission)
-    # Instead, we'll try to invoke a simple model call
-    model_id = os.getenv("MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
-    print(f"   Testing with model: {model_id}")
-    
-    # Build bedrock client with credentials
-    if aws_key and aws_secret:
-        bedrock_params = {
-            'service_name': 'bedrock-runtime',
-            'region_name': aws_region,
-            'aws_access_key_id': aws_key,
-            'aws_secret_access_key': aws_secret
-        }
-        if aws_session_token:
-            bedrock_params['aws_session_token'] = aws_session_token
-        bedrock = boto3.client(**bedrock_params)
-    
-    # Test invoke with minimal payload
-    test_body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 10,
-        "messages": [{"role": "user", "content": "Hi"}]
-    }
-    
-    response = bedrock.invoke_model(
-        modelId=model_id,
-        body=json.dumps(test_body)
-    )
-    print(f"   ✅ Bedrock access is VALID!")
-    print(f"   ✅ Model invocation successful!")
+    bedrock_probe.result()
+    emit(f"   ✅ Bedrock access is VALID!")
+    emit(f"   ✅ Model invocation successful!")
     
 except Exception as e:
     error_msg = str(e)
-    print(f"   ❌ Bedrock access failed: {error_msg}")
-    print()
+    emit(f"   ❌ Bedrock access failed: {error_msg}")
+    emit()
     
     if "UnrecognizedClientException" in error_msg or "invalid" in error_msg.lower():
-        print("   💡 This error usually means:")
-        print("      1. Credentials are invalid (already checked above)")
-        print("      2. Credentials don't have Bedrock permissions")
-        print("      3. Model access not enabled in AWS Console")
-        print()
-        print("   📋 Steps to fix:")
-        print("      1. Go to: https://console.aws.amazon.com/bedrock/")
-        print("      2. Click 'Model access' in left sidebar")
-        print("      3. Request access to Claude 3 Sonnet")
-        print("      4. Wait for approval (usually instant)")
+        emit("   💡 This error usually means:")
+        emit("      1. Credentials are invalid (already checked above)")
+        emit("      2. Credentials don't have Bedrock permissions")
+        emit("      3. Model access not enabled in AWS Console")
+        emit()
+        emit("   📋 Steps to fix:")
+        emit("      1. Go to: https://console.aws.amazon.com/bedrock/")
+        emit("      2. Click 'Model access' in left sidebar")
+        emit("      3. Request access to Claude 3 Sonnet")
+        emit("      4. Wait for approval (usually instant)")
     elif "AccessDeniedException" in error_msg:
-        print("   💡 Your credentials don't have Bedrock permissions.")
-        print("   💡 Add 'bedrock:InvokeModel' permission to your IAM user.")
+        emit("   💡 Your credentials don't have Bedrock permissions.")
+        emit("   💡 Add 'bedrock:InvokeModel' permission to your IAM user.")
     elif "ValidationException" in error_msg:
-        print("   💡 Model ID might be incorrect or not available in this region.")
-        print(f"   💡 Check available models in region: {aws_region}")
+        emit("   💡 Model ID might be incorrect or not available in this region.")
+        emit(f"   💡 Check available models in region: {aws_region}")
     else:
-        print(f"   💡 Unexpected error type: {type(e).__name__}")
+        emit(f"   💡 Unexpected error type: {type(e).__name__}")
 
-print()
-print("=" * 60)
+emit()
+emit("=" * 60)
 
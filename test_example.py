@@ -4,16 +4,10 @@ This file intentionally has some issues for demonstration.
 """
 
 def process_data(data):
-    result = []
-    for x in data:
-        result.append(x*2)
-    return result
+    return [x * 2 for x in data]
 
 def calculate_total(items):
-    total = 0
-    for item in items:
-        total += item.price
-    return total
+    return sum(item.price for item in items)
 
 class DataProcessor:
     def __init__(self, config):
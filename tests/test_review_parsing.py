@@ -0,0 +1,62 @@
+"""Tests for turning Claude replies into review dictionaries."""
+import orjson
+
+from review_agent import _complete_packed_reviews, parse_review_response
+
+
+def _reply(text):
+    return {"content": [{"type": "text", "text": text}]}
+
+
+def test_fenced_reply_with_suggestion_block_keeps_issues():
+    review = {
+        "summary": "One bug",
+        "issues": [{
+            "type": "bug",
+            "severity": "high",
+            "line": 3,
+            "message": "Off by one",
+            "suggestion": "```suggestion\nfor i in range(n):\n```"
+        }],
+        "missing_docstrings": [],
+        "overall_score": 7
+    }
+    text = "```json\n" + orjson.dumps(review, option=orjson.OPT_INDENT_2).decode() + "\n```"
+    
+    result = parse_review_response(_reply(text), "a.py")
+    
+    assert "raw_response" not in result
+    assert result["overall_score"] == 7
+    assert result["issues"][0]["message"] == "Off by one"
+    assert result["file_path"] == "a.py"
+
+
+def test_unterminated_fence_with_raw_suggestion_fence_is_repaired():
+    text = ('```json\n{"summary": "s", "issues": [{"line": 1, "suggestion": "x"},],\n'
+            '"overall_score": 6}\n```suggestion\nignored\n')
+    
+    result = parse_review_response(_reply(text))
+    
+    assert result["overall_score"] == 6
+    assert len(result["issues"]) == 1
+
+
+def test_unparseable_reply_falls_back_to_raw_text():
+    result = parse_review_response(_reply("no json here"), "b.py")
+    
+    assert result["raw_response"] == "no json here"
+    assert result["issues"] == []
+
+
+def test_truncated_packed_reply_keeps_finished_reviews():
+    packed = {"reviews": [
+        {"file_path": "a.py", "summary": "braces } { and \\\" in text", "overall_score": 7},
+        {"file_path": "b.py", "summary": "cut off", "overall_score": 8},
+    ]}
+    text = orjson.dumps(packed, option=orjson.OPT_INDENT_2).decode()
+    truncated = text[:text.index('"b.py"') + 8]
+    
+    reviews = _complete_packed_reviews(truncated)
+    
+    assert [review["file_path"] for review in reviews] == ["a.py"]
+    assert reviews[0]["summary"] == packed["reviews"][0]["summary"]